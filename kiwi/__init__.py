@@ -4,5 +4,6 @@
 #from .client import KiwiSDRStream
 #from .client import KiwiError,KiwiTooBusyError,KiwiDownError,KiwiBadPasswordError,KiwiTimeLimitError,KiwiServerTerminatedConnection,KiwiUnknownModulation
 from .client import *
+from .connection import KiwiConnection, FrameParser
 from .worker import KiwiWorker
 from .wavreader import *
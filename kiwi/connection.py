@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+## -*- python -*-
+
+"""
+Lean asyncio websocket client for the Kiwi streams
+
+FrameParser is sans-IO: the transport receives straight into its reusable buffer, complete
+messages are sliced out with memoryviews and copied once. KiwiConnection is an asyncio
+BufferedProtocol around it with the same send_message / receive_message surface as
+mod_pywebsocket's Stream. receive_message is a coroutine for the event loop thread, the other
+methods can be called from any thread.
+"""
+
+import asyncio
+import base64
+import collections
+import hashlib
+import os
+import re
+import struct
+import threading
+
+from mod_pywebsocket import common
+from mod_pywebsocket._stream_base import ConnectionTerminatedException, InvalidFrameException
+from mod_pywebsocket._stream_hybi import Frame, StreamOptions
+from mod_pywebsocket.extensions import PerMessageDeflateExtensionProcessor
+from .wsclient import ClientHandshakeError, _build_method_line, _format_host_header, _get_permessage_deflate_framer, _UPGRADE_HEADER, _CONNECTION_HEADER
+
+
+def mask_payload(payload, mask):
+    ## XOR with the 4-byte mask tiled over the payload, as one big integer operation
+    n = len(payload)
+    if n == 0:
+        return b''
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+
+def encode_frame(payload, opcode, mask=True):
+    ## a single final frame, clients must mask what they send
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, (0x80 if mask else 0) | n)
+    elif n < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, (0x80 if mask else 0) | 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, (0x80 if mask else 0) | 127, n)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + mask_payload(payload, key)
+
+
+class FrameParser(object):
+    """Incremental websocket frame parser over a reusable receive buffer."""
+
+    MIN_FREE = 4096
+
+    def __init__(self, size=1 << 16):
+        self.allow_rsv1 = False # set once permessage-deflate is negotiated
+        self._buf = bytearray(size)
+        self._start = 0 # first unparsed byte
+        self._end = 0 # end of received data
+        self._fragments = None # payload of a fragmented message so far
+        self._fragments_opcode = None
+        self._fragments_rsv1 = 0
+
+    def get_buffer(self):
+        ## writable space for the next receive, unparsed bytes are moved to the front first
+        if self._start:
+            pending = self._end - self._start
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < self.MIN_FREE:
+            ## a frame larger than the buffer: a new buffer, the old one may still be exported
+            buf = bytearray(2 * len(self._buf))
+            buf[:self._end] = self._buf[:self._end]
+            self._buf = buf
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        self._end += nbytes
+
+    def feed(self, data):
+        ## for byte-oriented transports
+        while data:
+            with self.get_buffer() as free:
+                n = min(len(free), len(data))
+                free[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+
+    def take(self, n):
+        ## raw bytes before the first frame, used by the opening handshake
+        data = bytes(self._buf[self._start:self._start+n])
+        self._start += n
+        return data
+
+    def find(self, sub):
+        i = self._buf.find(sub, self._start, self._end)
+        return -1 if i < 0 else i - self._start
+
+    def pending(self):
+        return self._end - self._start
+
+    def frames(self):
+        ## complete messages as (opcode, payload, rsv1 of the first frame), control frames may come between fragments
+        while True:
+            start, end = self._start, self._end
+            if end - start < 2:
+                return
+            b0, b1 = self._buf[start], self._buf[start+1]
+            if b0 & (0x30 if self.allow_rsv1 else 0x70):
+                raise InvalidFrameException('Unsupported flag is set (rsv = %d)' % ((b0 >> 4) & 7))
+            fin, rsv1, opcode, masked, length = b0 & 0x80, (b0 >> 6) & 1, b0 & 0x0f, b1 & 0x80, b1 & 0x7f
+            pos = start + 2
+            if length == 126:
+                if end - pos < 2:
+                    return
+                length, = struct.unpack_from('!H', self._buf, pos)
+                pos += 2
+            elif length == 127:
+                if end - pos < 8:
+                    return
+                length, = struct.unpack_from('!Q', self._buf, pos)
+                pos += 8
+            if masked:
+                if end - pos < 4:
+                    return
+                key = bytes(self._buf[pos:pos+4])
+                pos += 4
+            if end - pos < length:
+                return
+            with memoryview(self._buf) as view:
+                payload = bytes(view[pos:pos+length]) # the only copy of the payload
+            self._start = pos + length
+            if masked:
+                payload = mask_payload(payload, key)
+
+            if opcode & 0x8: # control frame
+                yield opcode, payload, 0
+            elif opcode == common.OPCODE_CONTINUATION:
+                if self._fragments is None:
+                    raise InvalidFrameException('Unexpected continuation frame')
+                self._fragments += payload
+                if fin:
+                    yield self._fragments_opcode, bytes(self._fragments), self._fragments_rsv1
+                    self._fragments = None
+            elif fin:
+                yield opcode, payload, rsv1
+            else:
+                self._fragments, self._fragments_opcode, self._fragments_rsv1 = bytearray(payload), opcode, rsv1
+
+
+class KiwiConnection(asyncio.BufferedProtocol):
+    """asyncio websocket client connection to a Kiwi stream.
+
+    With use_permessage_deflate the extension is offered and, when the Kiwi accepts it, incoming
+    messages go through the same framer filters as a Stream's. Outgoing messages are short commands,
+    they are sent uncompressed.
+    """
+
+    MAX_HEADER = 16384
+
+    def __init__(self, host, port, resource, use_permessage_deflate=False):
+        self._host = host
+        self._port = port
+        self._resource = resource
+        self._use_permessage_deflate = use_permessage_deflate
+        self.deflate = None # the permessage-deflate framer, once accepted
+        self._options = StreamOptions()
+        self._parser = FrameParser()
+        self._loop = None
+        self._thread_id = None
+        self._transport = None
+        self._key = base64.b64encode(os.urandom(16))
+        self._messages = collections.deque()
+        self._waiter = None
+        self._handshake = None
+        self._closed = False
+        self._error = None
+
+    @classmethod
+    async def open(cls, host, port, resource, timeout=10, use_permessage_deflate=False):
+        ## connect and run the opening handshake, resource is e.g. '/<timestamp>/SND'
+        loop = asyncio.get_running_loop()
+        _, conn = await asyncio.wait_for(loop.create_connection(
+            lambda: cls(host, port, resource, use_permessage_deflate), host, port), timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(conn._handshake), timeout)
+        except BaseException:
+            conn._transport.abort()
+            raise
+        return conn
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._handshake = self._loop.create_future()
+        fields = [_format_host_header(self._host, self._port, False), _UPGRADE_HEADER, _CONNECTION_HEADER,
+                  '%s: %s\r\n' % (common.SEC_WEBSOCKET_KEY_HEADER, self._key.decode()),
+                  '%s: %d\r\n' % (common.SEC_WEBSOCKET_VERSION_HEADER, common.VERSION_HYBI_LATEST)]
+        if self._use_permessage_deflate:
+            extension = common.ExtensionParameter(common.PERMESSAGE_DEFLATE_EXTENSION)
+            extension.add_parameter(PerMessageDeflateExtensionProcessor._CLIENT_MAX_WINDOW_BITS_PARAM, None)
+            fields.append('%s: %s\r\n' % (common.SEC_WEBSOCKET_EXTENSIONS_HEADER, common.format_extensions([extension])))
+        transport.write(_build_method_line(self._resource) + ''.join(fields).encode() + b'\r\n')
+
+    def get_buffer(self, sizehint):
+        return self._parser.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self._parser.buffer_updated(nbytes)
+        try:
+            if not self._handshake.done():
+                if not self._process_handshake():
+                    return
+            for opcode, payload, rsv1 in self._parser.frames():
+                self._process_frame(opcode, payload, rsv1)
+        except Exception as e:
+            self._fail(e)
+
+    def _process_handshake(self):
+        end = self._parser.find(b'\r\n\r\n')
+        if end < 0:
+            if self._parser.pending() > self.MAX_HEADER:
+                raise ClientHandshakeError('Handshake response too long')
+            return False
+        lines = self._parser.take(end + 4).decode('utf-8').split('\r\n')
+        m = re.match('HTTP/\\d+\\.\\d+ (\\d\\d\\d)', lines[0])
+        if m is None or m.group(1) != '101':
+            raise ClientHandshakeError('Expected HTTP status code 101 but found %r' % lines[0])
+        fields = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                fields[name.strip().lower()] = value.strip()
+        if fields.get(common.UPGRADE_HEADER.lower(), '').lower() != common.WEBSOCKET_UPGRADE_TYPE.lower():
+            raise ClientHandshakeError('Illegal value for header %s' % common.UPGRADE_HEADER)
+        expected = base64.b64encode(hashlib.sha1(self._key + common.WEBSOCKET_ACCEPT_UUID.encode()).digest()).decode()
+        if fields.get(common.SEC_WEBSOCKET_ACCEPT_HEADER.lower()) != expected:
+            raise ClientHandshakeError('Invalid %s header' % common.SEC_WEBSOCKET_ACCEPT_HEADER)
+        extensions = fields.get(common.SEC_WEBSOCKET_EXTENSIONS_HEADER.lower())
+        for extension in common.parse_extensions(extensions) if extensions else []:
+            if extension.name() != common.PERMESSAGE_DEFLATE_EXTENSION or not self._use_permessage_deflate:
+                raise ClientHandshakeError('Unexpected extension %r' % extension.name())
+            self.deflate = _get_permessage_deflate_framer(extension)
+            self.deflate.setup_stream_options(self._options)
+            self._parser.allow_rsv1 = True
+        self._handshake.set_result(True)
+        return True
+
+    def _process_frame(self, opcode, payload, rsv1):
+        if not opcode & 0x8 and self.deflate:
+            if rsv1:
+                for frame_filter in self._options.incoming_frame_filters:
+                    frame_filter.filter(Frame(rsv1=rsv1, opcode=opcode))
+            for message_filter in self._options.incoming_message_filters:
+                payload = message_filter.filter(payload)
+        if opcode == common.OPCODE_PING:
+            self._transport.write(encode_frame(payload, common.OPCODE_PONG))
+        elif opcode == common.OPCODE_PONG:
+            pass
+        elif opcode == common.OPCODE_CLOSE:
+            if not self._closed:
+                self._closed = True
+                self._transport.write(encode_frame(payload[:2], common.OPCODE_CLOSE))
+            self._transport.close()
+            self._deliver(None)
+        elif opcode == common.OPCODE_TEXT:
+            self._deliver(payload.decode('utf-8'))
+        elif opcode == common.OPCODE_BINARY:
+            self._deliver(payload)
+        else:
+            raise InvalidFrameException('Unsupported opcode %d' % opcode)
+
+    def _deliver(self, message):
+        self._messages.append(message)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_exception(error)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._transport.abort()
+
+    def connection_lost(self, exc):
+        if not self._closed:
+            self._fail(ConnectionTerminatedException('Connection lost: %s' % exc if exc else 'Connection closed without closing handshake'))
+
+    def _call(self, function, *args):
+        ## transports are not thread-safe, other threads hand the call over to the event loop
+        if threading.get_ident() == self._thread_id:
+            function(*args)
+        else:
+            self._loop.call_soon_threadsafe(function, *args)
+
+    def send_message(self, message, end=True, binary=False):
+        ## same signature as Stream.send_message, only whole messages are supported
+        if not end:
+            raise ValueError('Fragmented sends are not supported')
+        if self._closed or self._error is not None:
+            raise ConnectionTerminatedException('Connection is closed')
+        if binary:
+            frame = encode_frame(bytes(message), common.OPCODE_BINARY)
+        else:
+            frame = encode_frame(message.encode('utf-8'), common.OPCODE_TEXT)
+        self._call(self._transport.write, frame)
+
+    async def receive_message(self):
+        ## next text (str) or binary (bytes) message, None after a clean close
+        while not self._messages:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                return None
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+            self._waiter = None
+        return self._messages.popleft()
+
+    def close_connection(self, code=common.STATUS_NORMAL_CLOSURE, reason=''):
+        ## like STATUS_GOING_AWAY in Stream, the server reply is not waited for
+        if self._transport is not None:
+            self._call(self._close, code, reason)
+
+    def _close(self, code, reason):
+        if self._closed:
+            return
+        self._closed = True
+        self._transport.write(encode_frame(struct.pack('!H', code) + reason.encode('utf-8'), common.OPCODE_CLOSE))
+        self._transport.close()
+        self._deliver(None)
+
+    def abort(self):
+        ## a dead link gets no closing handshake
+        if self._transport is not None:
+            self._call(self._transport.abort)
@@ -387,11 +387,21 @@ class ClientHandshakeProcessor(ClientHandshakeBase):
         if (self._deflate_frame and not deflate_frame_accepted):
             raise ClientHandshakeError('Requested %s, but the server rejected it' % common.DEFLATE_FRAME_EXTENSION)
         if (self._use_permessage_deflate and not permessage_deflate_accepted):
-            raise ClientHandshakeError('Requested %s, but the server rejected it' % common.PERMESSAGE_DEFLATE_EXTENSION)
+            # compression is optional, go on uncompressed
+            self._logger.debug('Requested %s, but the server rejected it', common.PERMESSAGE_DEFLATE_EXTENSION)
+            self._use_permessage_deflate = False
 
         # TODO(tyoshino): Handle Sec-WebSocket-Protocol
         # TODO(tyoshino): Handle Cookie, etc.
 
+    def get_permessage_deflate_framer(self):
+        """Returns the framer of the accepted permessage-deflate extension or
+        None. Call its setup_stream_options before constructing the Stream.
+        """
+        if isinstance(self._use_permessage_deflate, _PerMessageDeflateFramer):
+            return self._use_permessage_deflate
+        return None
+
 
 class ClientConnection(object):
     """A wrapper for socket object to provide the mp_conn interface.
@@ -411,6 +421,9 @@ class ClientConnection(object):
     def read(self, n):
         return self._socket.recv(n)
 
+    def read_into(self, buf):
+        return self._socket.recv_into(buf)
+
     def get_remote_addr(self):
         return self._socket.getpeername()
     remote_addr = property(get_remote_addr)
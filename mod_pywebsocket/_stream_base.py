@@ -132,6 +132,26 @@ class StreamBase(object):
                 'Receiving %d byte failed. IOError (%s) occurred' %
                 (length, e))
 
+    def _read_into(self, buf):
+        """Reads available bytes from connection into the writable buffer
+        buf and returns their count. The connection must have read_into.
+
+        Raises:
+            ConnectionTerminatedException: when the peer closed connection.
+        """
+
+        try:
+            nbytes = self._request.connection.read_into(buf)
+            if not nbytes:
+                raise ConnectionTerminatedException(
+                    'Receiving %d byte failed. Peer (%r) closed connection' %
+                    (len(buf), (self._request.connection.remote_addr,)))
+            return nbytes
+        except socket.error as e:
+            raise ConnectionTerminatedException(
+                'Receiving %d byte failed. socket.error (%s) occurred' %
+                (len(buf), e))
+
     def _write(self, bytes_to_write):
         """Writes given bytes to connection. In case we catch any exception,
         prepends remote address to the exception message and raise again.
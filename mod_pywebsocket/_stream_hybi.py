@@ -413,6 +413,12 @@ class Stream(StreamBase):
     (RFC 6455).
     """
 
+    # Frames are parsed out of a read-ahead buffer filled by large reads
+    # instead of one read per header field and payload.
+    READ_AHEAD_SIZE = 65536
+    # Free space read_available() makes for each read.
+    MIN_READ_SIZE = 4096
+
     def __init__(self, request, options):
         """Constructs an instance.
 
@@ -440,6 +446,103 @@ class Stream(StreamBase):
 
         self._ping_queue = deque()
 
+        self._read_ahead = bytearray(self.READ_AHEAD_SIZE)
+        self._read_start = 0
+        self._read_end = 0
+
+    def _make_room(self, length):
+        """Makes the read-ahead buffer able to hold length unparsed bytes."""
+
+        if self._read_start + length > len(self._read_ahead):
+            # Move the unparsed bytes to the front, grow for large frames.
+            pending = self._read_end - self._read_start
+            self._read_ahead[:pending] = (
+                self._read_ahead[self._read_start:self._read_end])
+            self._read_start, self._read_end = 0, pending
+            if length > len(self._read_ahead):
+                self._read_ahead.extend(
+                    bytes(length - len(self._read_ahead)))
+
+    def _read_once(self):
+        """Reads available bytes into the free end of the read-ahead buffer.
+
+        Raises:
+            ConnectionTerminatedException: when read returns empty string.
+        """
+
+        if hasattr(self._request.connection, 'read_into'):
+            with memoryview(self._read_ahead) as view:
+                nbytes = self._read_into(view[self._read_end:])
+        else:
+            read_bytes = self._read(len(self._read_ahead) - self._read_end)
+            nbytes = len(read_bytes)
+            self._read_ahead[self._read_end:self._read_end + nbytes] = (
+                read_bytes)
+        self._read_end += nbytes
+
+    def _fill_read_ahead(self, length):
+        """Reads from connection until the read-ahead buffer holds at least
+        length unparsed bytes, as many as available in each read.
+
+        Raises:
+            ConnectionTerminatedException: when read returns empty string.
+        """
+
+        self._make_room(length)
+        while self._read_end - self._read_start < length:
+            self._read_once()
+
+    def read_available(self):
+        """Reads once from connection into the read-ahead buffer, as many
+        bytes as are available. Call it when the socket is readable, the
+        read does not block then. The frames are taken out with
+        receive_buffered_messages.
+
+        Raises:
+            ConnectionTerminatedException: when read returns empty string.
+        """
+
+        self._make_room(
+            self._read_end - self._read_start + self.MIN_READ_SIZE)
+        self._read_once()
+
+    def _receive_buffered_bytes(self, length):
+        """Receives length bytes through the read-ahead buffer."""
+
+        if self._read_end - self._read_start < length:
+            self._fill_read_ahead(length)
+        start = self._read_start
+        self._read_start += length
+        if self._read_start == self._read_end:
+            self._read_start = self._read_end = 0
+        with memoryview(self._read_ahead) as view:
+            return bytearray(view[start:start + length])
+
+    def has_buffered_frame(self):
+        """Returns True when a whole frame is waiting in the read-ahead
+        buffer. The socket does not become readable again for it.
+        """
+
+        available = self._read_end - self._read_start
+        if available < 2:
+            return False
+        second_byte = self._read_ahead[self._read_start + 1]
+        payload_length = second_byte & 0x7f
+        header_length = 2 + (4 if second_byte & 0x80 else 0)
+        if payload_length == 126:
+            if available < 4:
+                return False
+            payload_length = struct.unpack_from(
+                '!H', self._read_ahead, self._read_start + 2)[0]
+            header_length += 2
+        elif payload_length == 127:
+            if available < 10:
+                return False
+            payload_length = struct.unpack_from(
+                '!Q', self._read_ahead, self._read_start + 2)[0]
+            header_length += 8
+        return available >= header_length + payload_length
+
     def _receive_frame(self):
         """Receives a frame and return data in the frame as a tuple containing
         each header field and payload separately.
@@ -450,10 +553,7 @@ class Stream(StreamBase):
             InvalidFrameException: when the frame contains invalid data.
         """
 
-        def _receive_bytes(length):
-            return self.receive_bytes(length)
-
-        return parse_frame(receive_bytes=_receive_bytes,
+        return parse_frame(receive_bytes=self._receive_buffered_bytes,
                            logger=self._logger,
                            ws_version=self._request.ws_version,
                            unmask_receive=self._options.unmask_receive)
@@ -754,52 +854,77 @@ class Stream(StreamBase):
             # mp_conn.read will block if no bytes are available.
             # Timeout is controlled by TimeOut directive of Apache.
 
-            frame = self._receive_frame_as_frame_object()
-
-            # Check the constraint on the payload size for control frames
-            # before extension processes the frame.
-            # See also http://tools.ietf.org/html/rfc6455#section-5.5
-            if (common.is_control_opcode(frame.opcode) and
-                len(frame.payload) > 125):
-                raise InvalidFrameException(
-                    'Payload data size of control frames must be 125 bytes or '
-                    'less')
-
-            for frame_filter in self._options.incoming_frame_filters:
-                frame_filter.filter(frame)
-
-            if frame.rsv1 or frame.rsv2 or frame.rsv3:
-                raise UnsupportedFrameException(
-                    'Unsupported flag is set (rsv = %d%d%d)' %
-                    (frame.rsv1, frame.rsv2, frame.rsv3))
-
-            message = self._get_message_from_frame(frame)
-            if message is None:
-                continue
-
-            for message_filter in self._options.incoming_message_filters:
-                message = message_filter.filter(message)
-
-            if self._original_opcode == common.OPCODE_TEXT:
-                # The WebSocket protocol section 4.4 specifies that invalid
-                # characters must be replaced with U+fffd REPLACEMENT
-                # CHARACTER.
-                try:
-                    return message.decode('utf-8')
-                except UnicodeDecodeError as e:
-                    raise InvalidUTF8Exception(e)
-            elif self._original_opcode == common.OPCODE_BINARY:
+            done, message = self._receive_message_frame()
+            if done:
                 return message
-            elif self._original_opcode == common.OPCODE_CLOSE:
-                self._process_close_message(message)
-                return None
-            elif self._original_opcode == common.OPCODE_PING:
-                self._process_ping_message(message)
-            elif self._original_opcode == common.OPCODE_PONG:
-                self._process_pong_message(message)
-            else:
-                raise UnsupportedFrameException(
-                    'Opcode %d is not supported' % self._original_opcode)
+
+    def receive_buffered_messages(self):
+        """Yields the messages completed by the frames already in the
+        read-ahead buffer, as receive_message returns them, without reading
+        from connection. A message whose frames are not all there yet is
+        continued by a later call. Nothing follows the None of a closing
+        handshake.
+        """
+
+        while (not self._request.client_terminated and
+               self.has_buffered_frame()):
+            done, message = self._receive_message_frame()
+            if done:
+                yield message
+
+    def _receive_message_frame(self):
+        """Receives and processes one frame. Returns (True, message) when
+        the frame completes a message, as receive_message returns it, and
+        (False, None) for fragments and ping or pong frames.
+        """
+
+        frame = self._receive_frame_as_frame_object()
+
+        # Check the constraint on the payload size for control frames
+        # before extension processes the frame.
+        # See also http://tools.ietf.org/html/rfc6455#section-5.5
+        if (common.is_control_opcode(frame.opcode) and
+            len(frame.payload) > 125):
+            raise InvalidFrameException(
+                'Payload data size of control frames must be 125 bytes or '
+                'less')
+
+        for frame_filter in self._options.incoming_frame_filters:
+            frame_filter.filter(frame)
+
+        if frame.rsv1 or frame.rsv2 or frame.rsv3:
+            raise UnsupportedFrameException(
+                'Unsupported flag is set (rsv = %d%d%d)' %
+                (frame.rsv1, frame.rsv2, frame.rsv3))
+
+        message = self._get_message_from_frame(frame)
+        if message is None:
+            return False, None
+
+        for message_filter in self._options.incoming_message_filters:
+            message = message_filter.filter(message)
+
+        if self._original_opcode == common.OPCODE_TEXT:
+            # The WebSocket protocol section 4.4 specifies that invalid
+            # characters must be replaced with U+fffd REPLACEMENT
+            # CHARACTER.
+            try:
+                return True, message.decode('utf-8')
+            except UnicodeDecodeError as e:
+                raise InvalidUTF8Exception(e)
+        elif self._original_opcode == common.OPCODE_BINARY:
+            return True, message
+        elif self._original_opcode == common.OPCODE_CLOSE:
+            self._process_close_message(message)
+            return True, None
+        elif self._original_opcode == common.OPCODE_PING:
+            self._process_ping_message(message)
+        elif self._original_opcode == common.OPCODE_PONG:
+            self._process_pong_message(message)
+        else:
+            raise UnsupportedFrameException(
+                'Opcode %d is not supported' % self._original_opcode)
+        return False, None
 
     def _send_closing_handshake(self, code, reason):
         body = create_closing_handshake_body(code, reason)
@@ -523,6 +523,16 @@ class _PerMessageDeflateFramer(object):
     def set_compress_outgoing_enabled(self, value):
         self._compress_outgoing_enabled = value
 
+    def get_incoming_average_ratio(self):
+        """Returns (bytes received) / (bytes after inflating) so far, inf
+        before the first compressed message.
+        """
+        return self._incoming_average_ratio_calculator.get_average_ratio()
+
+    def get_outgoing_average_ratio(self):
+        """Returns (bytes sent) / (bytes before deflating) so far."""
+        return self._outgoing_average_ratio_calculator.get_average_ratio()
+
     def _process_incoming_message(self, message, decompress):
         if not decompress:
             return message
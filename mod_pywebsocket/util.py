@@ -31,7 +31,6 @@
 """WebSocket utilities."""
 
 
-import array
 import errno
 
 # Import hash classes from a module available and recommended for each Python
@@ -195,32 +194,28 @@ class RepeatedXorMasker(object):
                 (self._masking_key_index + len(s)) % len(self._masking_key))
         return masked_data
 
-    def _mask_using_array(self, s):
-        """Perform the mask via python."""
-        result = array.array('B')
-        result.frombytes(bytes(s))
+    def _mask_using_int(self, s):
+        """Perform the mask as a single XOR of two big integers.
 
-        # Use temporary local variables to eliminate the cost to access
-        # attributes
-        if type(self._masking_key[0]) is int:
-            masking_key = [x for x in self._masking_key]
-        else:
-            masking_key = map(ord, self._masking_key)
-        masking_key_size = len(masking_key)
-        masking_key_index = self._masking_key_index
-
-        for i in range(len(result)):
-            result[i] ^= masking_key[masking_key_index]
-            masking_key_index = (masking_key_index + 1) % masking_key_size
-
-        self._masking_key_index = masking_key_index
-
-        return result.tobytes()
+        The masking key is rotated to the current index and tiled over the
+        whole string, so the cost is a few C level passes over the data.
+        """
+        length = len(s)
+        if length == 0:
+            return b''
+        masking_key = bytes(self._masking_key)
+        index = self._masking_key_index
+        masking_key = masking_key[index:] + masking_key[:index]
+        tiled_key = masking_key * (length // len(masking_key) + 1)
+        masked = (int.from_bytes(s, 'little') ^
+                  int.from_bytes(tiled_key[:length], 'little'))
+        self._masking_key_index = (index + length) % len(masking_key)
+        return masked.to_bytes(length, 'little')
 
     if 'fast_masking' in globals():
         mask = _mask_using_swig
     else:
-        mask = _mask_using_array
+        mask = _mask_using_int
 
 
 # By making wbits option negative, we can suppress CMF/FLG (2 octet) and
@@ -272,7 +267,7 @@ class _Inflater(object):
         self._logger = get_class_logger(self)
         self._window_bits = window_bits
 
-        self._unconsumed = ''
+        self._unconsumed = b''
 
         self.reset()
 
@@ -280,7 +275,7 @@ class _Inflater(object):
         if not (size == -1 or size > 0):
             raise Exception('size must be -1 or positive')
 
-        data = ''
+        data = b''
 
         while True:
             if size == -1:
@@ -288,7 +283,7 @@ class _Inflater(object):
                 # See Python bug http://bugs.python.org/issue12050 to
                 # understand why the same code cannot be used for updating
                 # self._unconsumed for here and else block.
-                self._unconsumed = ''
+                self._unconsumed = b''
             else:
                 data += self._decompress.decompress(
                     self._unconsumed, size - len(data))
@@ -352,7 +347,7 @@ class _RFC1979Deflater(object):
         if bfinal:
             result = self._deflater.compress_and_finish(bytes)
             # Add a padding block with BFINAL = 0 and BTYPE = 0.
-            result = result + chr(0)
+            result = result + b'\x00'
             self._deflater = None
             return result
 
@@ -373,16 +368,41 @@ class _RFC1979Inflater(object):
 
     A decompressor class for byte sequence compressed and flushed following
     the algorithm described in the RFC1979 section 2.1.
+
+    Messages are inflated in a streaming way: the zlib context is kept across
+    messages (context takeover) and the compressed payload is handed to zlib
+    as is, without being appended to a pending buffer first.
+
+    Each message is still inflated into a new bytes object, zlib has no way
+    to decompress into a caller-provided buffer. Feeding the tail returns
+    the empty bytes object, the tail only closes the empty stored block of
+    the peer's sync flush.
     """
 
+    # The stripped LEN and NLEN field of a non-compressed block added for
+    # Z_SYNC_FLUSH.
+    _SYNC_FLUSH_TAIL = b'\x00\x00\xff\xff'
+
     def __init__(self, window_bits=zlib.MAX_WBITS):
-        self._inflater = _Inflater(window_bits)
+        self._window_bits = window_bits
+        self._decompress = zlib.decompressobj(-window_bits)
 
     def filter(self, bytes):
-        # Restore stripped LEN and NLEN field of a non-compressed block added
-        # for Z_SYNC_FLUSH.
-        self._inflater.append(bytes + '\x00\x00\xff\xff')
-        return self._inflater.decompress(-1)
+        data = self._inflate(bytes)
+        tail = self._inflate(self._SYNC_FLUSH_TAIL)
+        # The empty stored block normally inflates to nothing.
+        return data + tail if tail else data
+
+    def _inflate(self, bytes):
+        data = self._decompress.decompress(bytes)
+        if self._decompress.eof:
+            # A block with BFINAL = 1 ended the DEFLATE stream. The peer
+            # starts a new one for the rest of the input.
+            unused_data = self._decompress.unused_data
+            self._decompress = zlib.decompressobj(-self._window_bits)
+            if unused_data:
+                data += self._decompress.decompress(unused_data)
+        return data
 
 
 class DeflateSocket(object):
@@ -35,8 +35,20 @@ parser.add_option("-c", "--callsign", type=str,
                   help="DX CLUSTER Callsign", dest="callsign", default="")
 parser.add_option("-m", "--colormap", type=str,
                   help="colormap for waterfall", dest="colormap", default="cutesdr")
+parser.add_option("-C", "--compression",
+                  help="ADPCM compressed audio and waterfall streams (less bandwidth)", action="store_true", dest="compression", default=False)
+parser.add_option("-D", "--deflate",
+                  help="negotiate websocket permessage-deflate with the Kiwi (metered links)", action="store_true", dest="ws_deflate", default=False)
+parser.add_option("--panorama", type=str,
+                  help="stitched panorama range in kHz, e.g. 3500-30000 (P to show)", dest="panorama", default=None)
+parser.add_option("--panorama-kiwis", type=str,
+                  help="panorama Kiwis as host[:port[:password]],... (a host may be repeated), default the main Kiwi", dest="panorama_kiwis", default="")
+parser.add_option("--panorama-streams", type=int,
+                  help="number of W/F streams of the panorama", dest="panorama_streams", default=4)
 
 options = vars(parser.parse_args()[0])
+kiwi_waterfall.compression = kiwi_sound.compression = options["compression"]
+kiwi_waterfall.ws_deflate = kiwi_sound.ws_deflate = options["ws_deflate"]
 disp = display_stuff(options["winsize"])
 if disp.DISPLAY_WIDTH == 1920:
     sdrdisplay = pygame.display.set_mode((disp.DISPLAY_WIDTH, disp.DISPLAY_HEIGHT), 
@@ -57,6 +69,8 @@ disp.splash_screen(sdrdisplay)
 font = pygame.font.Font(None, 50)
 
 FPS = options['refresh']
+IDLE_MS = 100 # UI wake up period when no W/F line or input event arrives
+BIGMSG_S = 2.2 # how long a big message stays on screen
 
 CALLSIGN = options['callsign'].upper()
 dxclust = None
@@ -100,7 +114,8 @@ else:
 
 print(kiwi_host, kiwi_port, kiwi_password, zoom, freq)
 
-#init KIWI WF and RX audio
+#init KIWI WF and RX audio, all the Kiwi streams are received by a single I/O thread
+reactor = kiwi_reactor()
 kiwi_wf = None
 while not kiwi_wf:
     try:
@@ -118,8 +133,10 @@ while not kiwi_wf:
                 break
         kiwi_wf = None
 
-wf_t = threading.Thread(target=kiwi_wf.run, daemon=True)
-wf_t.start()
+reactor.add(kiwi_wf)
+kiwi_switch = kiwi_switcher(reactor, eibi, disp)
+supervisor = kiwi_supervisor(reactor) # dropped streams are reconnected in place
+supervisor.watch(kiwi_wf)
 
 kiwi_snd = kiwi_sound(freq, radio_mode, 30, 3000, kiwi_password, kiwi_wf, options["audio_buffer"])
 if not kiwi_snd:
@@ -131,6 +148,20 @@ kiwi_host2, kiwi_port2, kiwi_password2 = kiwi_host, kiwi_port, kiwi_password
 kiwi_snd2 = None
 
 play, kiwi_audio_stream = start_audio_stream(kiwi_snd)
+supervisor.watch(kiwi_snd)
+
+panorama = None
+if options["panorama"]:
+    try:
+        pan_start, pan_end = [float(f) for f in options["panorama"].split("-")]
+        pan_sources = []
+        for kiwi_data in filter(None, options["panorama_kiwis"].split(",")):
+            fields = kiwi_data.split(":")
+            pan_sources.append((fields[0], int(fields[1]) if len(fields) > 1 and fields[1] else kiwi_port, fields[2] if len(fields) > 2 else ""))
+        panorama = kiwi_panorama(pan_sources or [(kiwi_host, kiwi_port, kiwi_password)], pan_start, pan_end, options["panorama_streams"], eibi, disp, supervisor)
+    except Exception as e:
+        print("Panorama not available: %s" % e)
+        panorama = None
 # if not play:
 #     del kiwi_snd
 #     sys.exit("Chosen KIWI receiver is not ready!")
@@ -167,7 +198,8 @@ rssi_smooth = kiwi_snd.rssi
 rssi_smooth_slow = rssi_smooth
 rssi_smooth_hist = deque(rssi_maxlen*[kiwi_snd.rssi], rssi_maxlen)
 run_index = 0
-run_index_bigmsg = 0
+bigmsg_time = 0
+slow_update_time = 0
 
 run_index_automode = 0
 show_bigmsg = None
@@ -175,10 +207,13 @@ msg_text = ""
 fl.click_drag_flag = False
 
 check_time = datetime.utcnow()
+regions = dirty_regions()
+frame_ms = 1000/FPS
 
 while not wf_quit:
 
     run_index += 1
+    pass_time = time.monotonic()
 
     click_freq = None
     manual_wf_freq = None
@@ -190,16 +225,24 @@ while not wf_quit:
     rssi = kiwi_snd.rssi
     rssi_hist.append(rssi)
     mouse = pygame.mouse.get_pos()
-
-    for event in pygame.event.get():
+    wf_view = panorama if fl.show_panorama_flag and panorama else kiwi_wf # frequency axis under the mouse
+
+    # sleep until a W/F line or an input arrives, frames are capped at FPS by clock.tick below
+    events = [pygame.event.wait(IDLE_MS)] + pygame.event.get()
+    for event in events:
+        if event.type in (pygame.NOEVENT, WF_LINE_EVENT):
+            continue # new lines are tracked by the W/F line counter
+        regions.mark() # any input may change what is shown
         if event.type == pygame.VIDEORESIZE:
             scrsize = event.size
             width = event.w
             height = event.h
             disp.__init__(width, HEIGHT=height)
-            kiwi_wf.BINS2PIXEL_RATIO = disp.DISPLAY_WIDTH / kiwi_wf.WF_BINS
+            kiwi_wf.setup_display(disp)
+            if panorama:
+                panorama.setup_display(disp)
 
-        mouse_khz = kiwi_wf.bins_to_khz(mouse[0]/kiwi_wf.BINS2PIXEL_RATIO)
+        mouse_khz = wf_view.bins_to_khz(mouse[0]/wf_view.BINS2PIXEL_RATIO)
 
         if event.type == pygame.KEYDOWN:
             before_help_flag = fl.show_help_flag
@@ -212,7 +255,7 @@ while not wf_quit:
                 if keys[pygame.K_SPACE]:
                     force_sync_flag = True
                     show_bigmsg = "forcesync"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
 
                 # Show logger popup
                 if keys[pygame.K_0]:
@@ -230,6 +273,16 @@ while not wf_quit:
                 if keys[pygame.K_i]:
                     fl.show_eibi_flag = False if fl.show_eibi_flag else True
 
+                # Show stitched panorama instead of the main WF
+                if keys[pygame.K_p] and panorama:
+                    fl.show_panorama_flag = False if fl.show_panorama_flag else True
+                    kiwi_wf.wf_generation += 1 # the display rebuilds the waterfall it switches to
+                    panorama.wf_generation += 1
+                    wf_view = panorama if fl.show_panorama_flag else kiwi_wf
+                    eibi.get_stations(wf_view.start_f_khz, wf_view.end_f_khz)
+                    show_bigmsg = "panorama"
+                    bigmsg_time = time.monotonic()
+
                 # Show user memory labels
                 if keys[pygame.K_m] and (mods & pygame.KMOD_SHIFT):
                     fl.show_mem_flag = False if fl.show_mem_flag else True
@@ -257,31 +310,31 @@ while not wf_quit:
                     fl.wf_snd_link_flag = False if fl.wf_snd_link_flag else True
                     force_sync_flag = True
                     show_bigmsg = "centertune"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
 
                 # Memory read/write, reset, save to/load from disk
                 if keys[pygame.K_t]:
                     pass
                         # kiwi_memory.load_from_disk()
                         # show_bigmsg = "loadmemorydisk"
-                        # run_index_bigmsg = run_index
+                        # bigmsg_time = time.monotonic()
                 if keys[pygame.K_w]:
                     if event.mod & pygame.KMOD_SHIFT:
                         pass
                         # kiwi_memory.save_to_disk()
                         # show_bigmsg = "savememorydisk"
-                        # run_index_bigmsg = run_index
+                        # bigmsg_time = time.monotonic()
                     else:
                         kiwi_memory.write_mem(kiwi_snd.freq, kiwi_snd.radio_mode, delta_low, delta_high)
                         show_bigmsg = "writememory"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                 if keys[pygame.K_r]:
                     if event.mod & pygame.KMOD_SHIFT:
                         kiwi_memory.reset_all_mem()
                         show_bigmsg = "resetmemory"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                     else:
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                         mem_tmp = kiwi_memory.recall_mem()
                         if mem_tmp:
                             click_freq, kiwi_snd.radio_mode, delta_low, delta_high = mem_tmp
@@ -302,7 +355,9 @@ while not wf_quit:
                     sdrdisplay = pygame.display.set_mode((disp.DISPLAY_WIDTH, disp.DISPLAY_HEIGHT), pygame.DOUBLEBUF|pygame.RESIZABLE,vsync=1)
                     pygame.display.set_icon(icon)
                     pygame.display.set_caption("SuperSDR %s"%VERSION)
-                    kiwi_wf.BINS2PIXEL_RATIO = disp.DISPLAY_WIDTH / kiwi_wf.WF_BINS
+                    kiwi_wf.setup_display(disp)
+                    if panorama:
+                        panorama.setup_display(disp)
 
                 elif keys[pygame.K_j]:
                     old_delta_low, old_delta_high = delta_low, delta_high
@@ -372,38 +427,42 @@ while not wf_quit:
                     if not min_pb_flag and not max_pb_flag:
                         change_passband_flag = True
 
-                # KIWI WF averaging INC/DEC
-                if keys[pygame.K_g]:
+                # KIWI WF averaging INC/DEC, SHIFT switches dB/linear power averaging
+                if keys[pygame.K_g] and (mods & pygame.KMOD_SHIFT):
+                    kiwi_wf.power_averaging = not kiwi_wf.power_averaging
+                    show_bigmsg = "WFAVG"
+                    bigmsg_time = time.monotonic()
+                elif keys[pygame.K_g]:
                     if kiwi_wf.averaging_n < 100:
                         kiwi_wf.averaging_n += 1
                     show_bigmsg = "WFAVG"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
                 elif keys[pygame.K_h]:
                     if kiwi_wf.averaging_n > 1:
                         kiwi_wf.averaging_n -= 1
                     show_bigmsg = "WFAVG"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
 
                 # KIWI RX volume UP/DOWN, Mute
                 if keys[pygame.K_v] and (mods & pygame.KMOD_SHIFT):
-                    if run_index_bigmsg < run_index:
+                    if bigmsg_time < pass_time:
                         if kiwi_snd.volume > 0:
                             old_volume = kiwi_snd.volume
                             kiwi_snd.volume = 0
                         else:
                             kiwi_snd.volume = old_volume
                         show_bigmsg = "VOLUME"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                 elif keys[pygame.K_v]:
                     if kiwi_snd.volume < 150:
                         kiwi_snd.volume += 10
                     show_bigmsg = "VOLUME"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
                 elif keys[pygame.K_b]:
                     if kiwi_snd.volume > 0:
                         kiwi_snd.volume -= 10
                     show_bigmsg = "VOLUME"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
                 
                 if keys[pygame.K_3]:
                     kiwi_wf.wf_auto_scaling = False if kiwi_wf.wf_auto_scaling else True
@@ -499,19 +558,23 @@ while not wf_quit:
                     current_string = []
 
                 # WF fill spectrum ON/OFF
-                if keys[pygame.K_4]:
+                if keys[pygame.K_4] and not (mods & pygame.KMOD_SHIFT):
                     disp.SPECTRUM_FILLED = False if disp.SPECTRUM_FILLED else True
+                elif keys[pygame.K_4] and (mods & pygame.KMOD_SHIFT):
+                    kiwi_wf.spectrum_avg.next_mode()
+                    show_bigmsg = "spectrum_avg"
+                    bigmsg_time = time.monotonic()
 
                 # Start/stop audio recording to file
                 if keys[pygame.K_e]:
                     if not kiwi_snd.audio_rec.recording_flag:
                         kiwi_snd.audio_rec.start()
                         show_bigmsg = "start_rec"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                     else:
                         kiwi_snd.audio_rec.stop()
                         show_bigmsg = "stop_rec"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
 
                 # S-meter show/hide
                 if keys[pygame.K_m] and not (mods & pygame.KMOD_SHIFT):
@@ -528,7 +591,7 @@ while not wf_quit:
                             cat_radio = None
                     if cat_radio:
                         show_bigmsg = "cat_rx_sync"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                         fl.cat_snd_link_flag = False if fl.cat_snd_link_flag else True
                         force_sync_flag = True
 
@@ -536,7 +599,7 @@ while not wf_quit:
                 # Automatic mode change ON/OFF
                 if keys[pygame.K_x]:
                     show_bigmsg = "automode"
-                    run_index_bigmsg = run_index
+                    bigmsg_time = time.monotonic()
                     fl.auto_mode = False if fl.auto_mode else True
                     if fl.auto_mode:
                         kiwi_snd.radio_mode = get_auto_mode(kiwi_snd.freq)
@@ -551,11 +614,11 @@ while not wf_quit:
                         if kiwi_snd.thresh>-135:
                             kiwi_snd.thresh -= 1
                             show_bigmsg = "agc threshold"
-                            run_index_bigmsg = run_index
+                            bigmsg_time = time.monotonic()
                     else:
                         kiwi_snd.change_agc_delay(-100)
                         show_bigmsg = "agc decay"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                     if kiwi_snd:
                         kiwi_snd.set_agc_params()
                 if keys[pygame.K_2]:
@@ -563,11 +626,11 @@ while not wf_quit:
                         if kiwi_snd.thresh<-20:
                             kiwi_snd.thresh += 1
                             show_bigmsg = "agc threshold"
-                            run_index_bigmsg = run_index
+                            bigmsg_time = time.monotonic()
                     else:
                         kiwi_snd.change_agc_delay(100)
                         show_bigmsg = "agc decay"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                     if kiwi_snd:
                         kiwi_snd.set_agc_params()
 
@@ -595,6 +658,7 @@ while not wf_quit:
                             kiwi_snd, kiwi_snd2 = kiwi_snd2, kiwi_snd
                             fl.main_sub_switch_flag = True if not fl.main_sub_switch_flag else False
 
+                        supervisor.unwatch(kiwi_snd2)
                         kiwi_snd2.terminate = True
                         kiwi_audio_stream2.stop()
                         kiwi_audio_stream2.close()
@@ -605,7 +669,7 @@ while not wf_quit:
 
                         fl.dualrx_flag = False
                         show_bigmsg = "disable2rx"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                         kiwi_snd2 = None
                 # Switch audio MAIN/SUB VFOs
                 elif keys[pygame.K_y]:
@@ -618,25 +682,26 @@ while not wf_quit:
                             cat_radio.set_freq(kiwi_snd.freq + (CW_PITCH if kiwi_snd.radio_mode=="CW" else 0.))
                             cat_radio.set_mode(kiwi_snd.radio_mode)
                         show_bigmsg = "switchab"
-                        run_index_bigmsg = run_index
+                        bigmsg_time = time.monotonic()
                     else:
                         try:
                             kiwi_snd2 = kiwi_sound(kiwi_snd.freq, kiwi_snd.radio_mode, 30, 3000, kiwi_password2, kiwi_wf, kiwi_snd.FULL_BUFF_LEN, host_ = kiwi_host2, port_ = kiwi_port2, subrx_ = True)
                             play2, kiwi_audio_stream2 = start_audio_stream(kiwi_snd2)
+                            supervisor.watch(kiwi_snd2)
                             kiwi_snd2.radio_mode = get_auto_mode(kiwi_wf.freq)
                             lc, hc = kiwi_snd2.change_passband(delta_low, delta_high)
                             kiwi_snd2.freq = kiwi_wf.freq
                             kiwi_snd2.set_mode_freq_pb()
                             print("Second RX active!")
                             show_bigmsg = "enable2rx"
-                            run_index_bigmsg = run_index
+                            bigmsg_time = time.monotonic()
                             fl.dualrx_flag = True
                         except:
                             print("Server not ready")
                             kiwi_snd2 = None
                             fl.dualrx_flag = False
                             show_bigmsg = "disable2rx"
-                            run_index_bigmsg = run_index
+                            bigmsg_time = time.monotonic()
 
                 # Quit SuperSDR
                 if keys[pygame.K_ESCAPE] and keys[pygame.K_LSHIFT]:
@@ -685,9 +750,11 @@ while not wf_quit:
         # Quit
         if event.type == pygame.QUIT:
             wf_quit = True
-        # KIWI WF mouse zooming
+        # KIWI WF mouse zooming, the panorama range is fixed
         elif event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 4: # mouse scroll up
+            if event.button in (4, 5) and wf_view is not kiwi_wf:
+                pass
+            elif event.button == 4: # mouse scroll up
                 if kiwi_wf.zoom<kiwi_wf.MAX_ZOOM:
                     t_khz = kiwi_wf.bins_to_khz(mouse[0]/kiwi_wf.BINS2PIXEL_RATIO)
                     zoom_f = (t_khz+kiwi_wf.freq)/2
@@ -704,10 +771,10 @@ while not wf_quit:
                     kiwi_wf.zoom_to_span()
                     kiwi_wf.start_freq()
                     kiwi_wf.end_freq()
-                    click_freq = kiwi_wf.bins_to_khz(mouse[0]/kiwi_wf.BINS2PIXEL_RATIO)
+                    click_freq = wf_view.bins_to_khz(mouse[0]/wf_view.BINS2PIXEL_RATIO)
                     if kiwi_snd.radio_mode == "CW":
                         click_freq -= CW_PITCH # tune CW signal taking into account cw offset
-                if disp.SPECTRUM_Y <= mouse[1] <= disp.TUNEBAR_Y:
+                if disp.SPECTRUM_Y <= mouse[1] <= disp.TUNEBAR_Y and wf_view is kiwi_wf:
                     pygame.mouse.get_rel()
                     fl.start_drag_x = mouse[0]/kiwi_wf.BINS2PIXEL_RATIO
                     fl.click_drag_flag = True
@@ -727,7 +794,8 @@ while not wf_quit:
         try:
             dxclust = dxcluster(CALLSIGN)
             if dxclust:
-                dx_t = threading.Thread(target=dxclust.run, args=(kiwi_wf,), daemon=True)
+                dxclust.kiwi_wf = kiwi_wf
+                dx_t = threading.Thread(target=dxclust.run, daemon=True)
                 dx_t.start()
                 if old_spot_dict:
                     dxclust.spot_dict = old_spot_dict
@@ -741,59 +809,29 @@ while not wf_quit:
         fl.connect_dxcluster_flag = False
 
     if kiwilist.connect_new_flag:
-        # close audio stream
-        kiwi_audio_stream.stop()
-        kiwi_audio_stream.close()
-        if kiwi_snd2:
-            kiwi_audio_stream2.stop()
-            kiwi_audio_stream2.close()
-
-        old_volume = kiwi_snd.volume
-        kiwi_snd.terminate = True
-        if kiwi_snd2:
-            kiwi_snd2.terminate = True
-
-        kiwi_wf.terminate = True
-        time.sleep(1)
-
-        kiwi_wf.close_connection()
-        kiwi_snd.close_connection()
-        if kiwi_snd2:
-            kiwi_snd2.close_connection()
-        
-        kiwi_snd.terminate = False
-        if kiwi_snd2:
-            kiwi_snd2.terminate = False
-            fl.dualrx_flag = False
-        kiwi_wf.terminate = False
-
+        # the current streams keep running until the new server delivers data
         new_host = kiwilist.kiwi_host
         new_port, new_password  = kiwilist.kiwi_port if kiwilist.kiwi_port!=None else kiwi_port, kiwilist.kiwi_password if kiwilist.kiwi_password!=None else kiwi_password
+        kiwi_switch.start(new_host, new_port, new_password, kiwi_wf, kiwi_snd, kiwi_audio_stream)
+        kiwilist.connect_new_flag = False
 
-        try:
-            kiwi_wf.__init__(new_host, new_port, new_password, kiwi_wf.zoom, kiwi_wf.freq, eibi, disp)
-            kiwi_snd.__init__(kiwi_snd.freq, radio_mode, 30, 3000, new_password, kiwi_wf, kiwi_snd.FULL_BUFF_LEN, volume_ = old_volume)
-            print("Changed server to: %s:%d" % (new_host,new_port))
-            play, kiwi_audio_stream = start_audio_stream(kiwi_snd)
-        except:
-            print ("something went wrong...")
-            play = None
-        if not play:
-            kiwi_wf = kiwi_waterfall(kiwi_host, kiwi_port, kiwi_password, kiwi_wf.zoom, kiwi_wf.freq, eibi, disp)
-            kiwi_snd = kiwi_sound(kiwi_snd.freq, radio_mode, 30, 3000, kiwi_password, kiwi_wf, kiwi_snd.FULL_BUFF_LEN, volume_ = old_volume)
-            print("Reverted back to server: %s:%d" % (kiwi_host, kiwi_port))
-            play, kiwi_audio_stream = start_audio_stream(kiwi_snd)
-            if not play:
-                exit("Old kiwi server not available anymore!")
-        else:
-            kiwi_host, kiwi_port, kiwi_password = new_host, new_port, new_password
-
+    switched = kiwi_switch.poll()
+    if switched:
+        new_host, new_port, new_password, new_wf, new_snd = switched
+        old_snds = [(kiwi_snd, None)] + ([(kiwi_snd2, kiwi_audio_stream2)] if kiwi_snd2 else [])
+        kiwi_switch.swap(kiwi_wf, new_wf, old_snds, new_snd, kiwi_audio_stream)
+        supervisor.watch(new_wf)
+        supervisor.watch(new_snd)
+        kiwi_wf, kiwi_snd = new_wf, new_snd
+        if dxclust:
+            dxclust.kiwi_wf = kiwi_wf
+            dxclust.update_now = True
+        kiwi_host, kiwi_port, kiwi_password = new_host, new_port, new_password
+        print("Changed server to: %s:%d" % (kiwi_host, kiwi_port))
         kiwi_snd2 = None
-
-        wf_t = threading.Thread(target=kiwi_wf.run, daemon=True)
-        wf_t.start()
-            
-        kiwilist.connect_new_flag = False
+        fl.dualrx_flag = False
+        fl.main_sub_switch_flag = False
+        regions.mark()
 
     # Change KIWI RX PB: this can only affect the SND stream
     if change_passband_flag:
@@ -826,7 +864,7 @@ while not wf_quit:
     # Change KIWI RX mode
     if manual_mode:
         show_bigmsg = "changemode"
-        run_index_bigmsg = run_index
+        bigmsg_time = time.monotonic()
         if kiwi_snd:
             kiwi_snd.radio_mode = manual_mode
             lc, hc = kiwi_snd.change_passband(delta_low, delta_high)
@@ -923,126 +961,155 @@ while not wf_quit:
     if not cat_radio:
         fl.cat_snd_link_flag = False
 
-    # Plot top spectrum and bottom waterfall
-    if not run_index%min(5, kiwi_wf.averaging_n):
-        disp.plot_spectrum(sdrdisplay, kiwi_wf, filled=disp.SPECTRUM_FILLED, col=YELLOW)
-        wf_surface = pygame.surfarray.make_surface(kiwi_wf.wf_data.T)
-        wf_surface.set_palette(palRGB)
-        if disp.DISPLAY_WIDTH != kiwi_wf.WF_BINS:
-            wf_surface = pygame.Surface.convert(wf_surface)
-            wf_surface = pygame.transform.smoothscale(wf_surface, (disp.DISPLAY_WIDTH, disp.WF_HEIGHT))
-        sdrdisplay.blit(wf_surface, (0, disp.WF_Y))
-
     rssi_last = rssi_hist[-1]
     if math.fabs(rssi_last) > math.fabs(rssi_smooth):
         # rssi_smooth -= (1000/kiwi_snd.decay) # s-meter decay rate
         v0 = -20+135# max signal value dBm
         t = math.log(v0/(rssi_smooth+135))
-        rssi_smooth += -v0/(kiwi_snd.decay/(1000/(2*FPS))) * math.exp(-t)
+        rssi_smooth += -v0/(kiwi_snd.decay/(frame_ms/2)) * math.exp(-t)
+        rssi_smooth = max(rssi_smooth, rssi_last)
     else:
-        rssi_smooth += min((rssi_last - rssi_smooth)/5, 3) # attack rate
+        # attack rate, scaled by the actual frame time
+        frames = frame_ms*FPS/1000
+        rssi_smooth += min((rssi_last - rssi_smooth)*(1-0.8**frames), 3*frames)
 
-    if not run_index%20:
+    if pass_time - slow_update_time >= SLOW_UPDATE_S:
+        slow_update_time = pass_time
         # rssi_smooth_slow = rssi_smooth
         rssi_smooth_slow = max(rssi_hist)
 
-    pygame.draw.rect(sdrdisplay, (0,0,80), (0,0,disp.DISPLAY_WIDTH,disp.TOPBAR_HEIGHT), 0)
-    pygame.draw.rect(sdrdisplay, (0,0,80), (0,disp.TUNEBAR_Y,disp.DISPLAY_WIDTH,disp.TUNEBAR_HEIGHT), 0)
-    pygame.draw.rect(sdrdisplay, (0,0,0), (0,disp.BOTTOMBAR_Y,disp.DISPLAY_WIDTH,disp.DISPLAY_HEIGHT), 0)
-    disp.draw_lines(sdrdisplay, wf_height, kiwi_snd.radio_mode, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio)
-    disp.update_textsurfaces(sdrdisplay, kiwi_snd.radio_mode, rssi_smooth, rssi_smooth_slow, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, kiwi_host2, run_index)
-
-    if fl.show_eibi_flag and kiwi_wf.zoom > 6:
-        disp.plot_eibi(sdrdisplay, eibi, kiwi_wf)
-    if fl.show_mem_flag:
-        disp.plot_memories(sdrdisplay, kiwi_memory, kiwi_wf)
-    elif fl.show_dxcluster_flag and kiwi_wf.zoom > 3:
-        disp.plot_dxcluster(sdrdisplay, dxclust, kiwi_wf)
-
     time_now = datetime.utcnow()
     if check_time.second != time_now.second and not time_now.second % 10:
         check_time = time_now
         beacon_project.which_beacons()
         # print(beacon_project.beacons_dict)
-    if kiwi_wf.zoom > 8:
-        disp.plot_beacons(sdrdisplay, beacon_project, kiwi_wf)
-
-    if fl.input_freq_flag:
-        question = "Freq (kHz)"
-        disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 200)
-    elif fl.input_callsign_flag:
-        question = "DXCLuster CALLSIGN"
-        disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 300)
-    elif fl.input_qso_flag:
-        question = "CALL"
-        disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 300)
-    elif fl.input_server_flag:
-        kiwilist.choose_kiwi_dialog()
-        fl.input_server_flag = False
-        # disp.display_kiwi_box(sdrdisplay, current_string, kiwilist)
-    elif fl.show_help_flag:
-        disp.display_help_box(sdrdisplay, HELP_MESSAGE_LIST)
-    elif show_bigmsg:
-        pos = None
-        msg_color = WHITE
-        if run_index - run_index_bigmsg > 65:
-            show_bigmsg = None
-        if "VOLUME" == show_bigmsg:
-            msg_color = WHITE if kiwi_snd.volume <= 100 else RED
-            msg_text = "VOLUME: %d"%(kiwi_snd.volume)+'%'
-        if "WFAVG" == show_bigmsg:
-            msg_color = WHITE if kiwi_wf.averaging_n == 1 else RED
-            msg_text = "WF AVG %dX -> %.2fs"%(kiwi_wf.averaging_n, kiwi_wf.averaging_n/FPS)
-        elif "cat_rx_sync" == show_bigmsg:
-            msg_text = "CAT<->RX SYNC "+("ON" if fl.cat_snd_link_flag else "OFF")
-        elif "forcesync" == show_bigmsg:
-            msg_text = "Center RX passband" if not cat_radio else "Force SYNC WF & RX -> CAT"
-        elif "switchab" == show_bigmsg:
-            msg_text = "Switch MAIN/SUB RXs"
-        elif "enable2rx" == show_bigmsg:
-            msg_text = "SUB RX enabled"
-        elif "disable2rx" == show_bigmsg:
-            msg_text = "SUB RX disabled"
-        elif "automode" == show_bigmsg:
-            msg_text = "AUTO MODE "+("ON" if fl.auto_mode else "OFF")
-        elif "changemode" == show_bigmsg:
-            msg_text = kiwi_snd.radio_mode
-        elif "writememory" == show_bigmsg:
-            msg_text = "Stored Memory %d"% (len(kiwi_memory.mem_list)-1)
-        elif "recallmemory" == show_bigmsg:
-            msg_text = "Recall memory:%d -> %s"% (kiwi_memory.index, 
-                str(kiwi_memory.mem_list[kiwi_memory.index][0])+" kHz "+kiwi_memory.mem_list[kiwi_memory.index][1]) 
-            pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
-        elif "resetmemory" == show_bigmsg:
-            msg_text = "Reset All Memories!"
-        elif "loadmemorydisk" == show_bigmsg:
-            msg_text = "Load Memories from Disk"
-            pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
-        elif "savememorydisk" == show_bigmsg:
-            msg_text = "Save All Memories to Disk"
-            pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
-        elif "emptymemory" == show_bigmsg:
-            msg_text = "No Memories!"
-        elif "start_rec" == show_bigmsg:
-            msg_text = "Start recording"
-        elif "stop_rec" == show_bigmsg:
-            msg_text = "Save recording"
-        elif "centertune" == show_bigmsg:
-            msg_text = "WF center tune mode " + ("ON" if fl.wf_snd_link_flag else "OFF")
-        elif "agc threshold" == show_bigmsg:
-            msg_text = "AGC threshold: %d dBm" % kiwi_snd.thresh
-        elif "agc decay" == show_bigmsg:
-            msg_text = "AGC decay: %.1f s" % (kiwi_snd.decay/1000)
-
-        disp.display_msg_box(sdrdisplay, msg_text, pos=pos, color=msg_color)
 
+    if show_bigmsg and time.monotonic() - bigmsg_time > BIGMSG_S:
+        show_bigmsg = None
+
+    # redraw and push to the screen only the bands whose inputs changed since the last frame
+    wf_view = panorama if fl.show_panorama_flag and panorama else kiwi_wf
+    regions.check("wf", (wf_view.wf_lines, wf_view.wf_generation), "spectrum", "wf")
+    regions.check("top", (time_now.second, round(rssi_smooth_slow), cat_radio.cat_tx if cat_radio else None), "top")
+    regions.check("bottom", (disp.audio_buff_len, disp.audio_buff_len2, disp.deflate_text, kiwi_snd.adc_overflow_flag, kiwi_snd.audio_rec.recording_flag and blink_on()), "bottom")
+    regions.check("radio", (kiwi_wf.freq, kiwi_wf.zoom, kiwi_wf.tune, kiwi_snd.freq, kiwi_snd.radio_mode, kiwi_snd.lc, kiwi_snd.hc, kiwi_snd.volume,
+        cat_radio.freq if cat_radio else None, kiwi_snd2.freq if kiwi_snd2 else None, show_bigmsg))
     if fl.s_meter_show_flag:
-        smeter_surface = disp.s_meter_draw(rssi_smooth, rssi_smooth_slow, kiwi_snd.thresh, kiwi_snd.decay)
-        sdrdisplay.blit(smeter_surface, (0, disp.BOTTOMBAR_Y-(disp.s_meter_radius+disp.BOTTOMBAR_HEIGHT)))
+        regions.check("smeter", round(rssi_smooth), "wf")
+    # labels are clipped to the band they belong to and drawn again with it, only their changes mark it
+    regions.check("labels", (fl.show_eibi_flag, fl.show_mem_flag, fl.show_dxcluster_flag, len(kiwi_memory.mem_list),
+        tuple(dxclust.visible_stations) if dxclust else None, tuple(beacon_project.beacons_dict.values()), time_now.minute), "spectrum", "wf")
+
+    if regions.dirty:
+        dirty_rect = regions.span(disp)
+        sdrdisplay.set_clip(dirty_rect)
+        # Plot top spectrum and bottom waterfall
+        if "spectrum" in regions.dirty:
+            disp.plot_spectrum(sdrdisplay, wf_view, filled=disp.SPECTRUM_FILLED, col=YELLOW)
+        if "wf" in regions.dirty:
+            disp.plot_waterfall(sdrdisplay, wf_view, palRGB)
+
+        pygame.draw.rect(sdrdisplay, (0,0,80), (0,0,disp.DISPLAY_WIDTH,disp.TOPBAR_HEIGHT), 0)
+        pygame.draw.rect(sdrdisplay, (0,0,80), (0,disp.TUNEBAR_Y,disp.DISPLAY_WIDTH,disp.TUNEBAR_HEIGHT), 0)
+        pygame.draw.rect(sdrdisplay, (0,0,0), (0,disp.BOTTOMBAR_Y,disp.DISPLAY_WIDTH,disp.DISPLAY_HEIGHT), 0)
+        disp.draw_lines(sdrdisplay, wf_height, kiwi_snd.radio_mode, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, wf_view)
+        disp.update_textsurfaces(sdrdisplay, kiwi_snd.radio_mode, rssi_smooth, rssi_smooth_slow, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, kiwi_host2, wf_view)
+
+        # overlays follow the frequency axis shown, the zoom of a panorama is the one of its windows.
+        # EiBi and DX spots label the waterfall, memories and beacons the spectrum
+        sdrdisplay.set_clip(regions.rect(disp, "wf").clip(dirty_rect))
+        if fl.show_eibi_flag and wf_view.zoom > 6:
+            disp.plot_eibi(sdrdisplay, eibi, wf_view)
+        if not fl.show_mem_flag and fl.show_dxcluster_flag and wf_view.zoom > 3:
+            disp.plot_dxcluster(sdrdisplay, dxclust, wf_view)
+        sdrdisplay.set_clip(regions.rect(disp, "spectrum").clip(dirty_rect))
+        if fl.show_mem_flag:
+            disp.plot_memories(sdrdisplay, kiwi_memory, wf_view)
+        if wf_view.zoom > 8:
+            disp.plot_beacons(sdrdisplay, beacon_project, wf_view)
+        sdrdisplay.set_clip(dirty_rect)
+
+        if fl.input_freq_flag:
+            question = "Freq (kHz)"
+            disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 200)
+        elif fl.input_callsign_flag:
+            question = "DXCLuster CALLSIGN"
+            disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 300)
+        elif fl.input_qso_flag:
+            question = "CALL"
+            disp.display_box(sdrdisplay, question + ": " + "".join(current_string), 300)
+        elif fl.input_server_flag:
+            kiwilist.choose_kiwi_dialog()
+            fl.input_server_flag = False
+            # disp.display_kiwi_box(sdrdisplay, current_string, kiwilist)
+        elif fl.show_help_flag:
+            disp.display_help_box(sdrdisplay, HELP_MESSAGE_LIST)
+        elif show_bigmsg:
+            pos = None
+            msg_color = WHITE
+            if "VOLUME" == show_bigmsg:
+                msg_color = WHITE if kiwi_snd.volume <= 100 else RED
+                msg_text = "VOLUME: %d"%(kiwi_snd.volume)+'%'
+            if "WFAVG" == show_bigmsg:
+                msg_color = WHITE if kiwi_wf.averaging_n == 1 else RED
+                msg_text = "WF AVG %dX -> %.2fs %s"%(kiwi_wf.averaging_n, kiwi_wf.averaging_n/FPS, "PWR" if kiwi_wf.power_averaging else "dB")
+            elif "cat_rx_sync" == show_bigmsg:
+                msg_text = "CAT<->RX SYNC "+("ON" if fl.cat_snd_link_flag else "OFF")
+            elif "forcesync" == show_bigmsg:
+                msg_text = "Center RX passband" if not cat_radio else "Force SYNC WF & RX -> CAT"
+            elif "switchab" == show_bigmsg:
+                msg_text = "Switch MAIN/SUB RXs"
+            elif "enable2rx" == show_bigmsg:
+                msg_text = "SUB RX enabled"
+            elif "disable2rx" == show_bigmsg:
+                msg_text = "SUB RX disabled"
+            elif "automode" == show_bigmsg:
+                msg_text = "AUTO MODE "+("ON" if fl.auto_mode else "OFF")
+            elif "changemode" == show_bigmsg:
+                msg_text = kiwi_snd.radio_mode
+            elif "writememory" == show_bigmsg:
+                msg_text = "Stored Memory %d"% (len(kiwi_memory.mem_list)-1)
+            elif "recallmemory" == show_bigmsg:
+                msg_text = "Recall memory:%d -> %s"% (kiwi_memory.index, 
+                    str(kiwi_memory.mem_list[kiwi_memory.index][0])+" kHz "+kiwi_memory.mem_list[kiwi_memory.index][1]) 
+                pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
+            elif "resetmemory" == show_bigmsg:
+                msg_text = "Reset All Memories!"
+            elif "loadmemorydisk" == show_bigmsg:
+                msg_text = "Load Memories from Disk"
+                pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
+            elif "savememorydisk" == show_bigmsg:
+                msg_text = "Save All Memories to Disk"
+                pos = (disp.DISPLAY_WIDTH / 2 - 300, disp.DISPLAY_HEIGHT / 4 - 10)
+            elif "emptymemory" == show_bigmsg:
+                msg_text = "No Memories!"
+            elif "start_rec" == show_bigmsg:
+                msg_text = "Start recording"
+            elif "stop_rec" == show_bigmsg:
+                msg_text = "Save recording"
+            elif "centertune" == show_bigmsg:
+                msg_text = "WF center tune mode " + ("ON" if fl.wf_snd_link_flag else "OFF")
+            elif "agc threshold" == show_bigmsg:
+                msg_text = "AGC threshold: %d dBm" % kiwi_snd.thresh
+            elif "agc decay" == show_bigmsg:
+                msg_text = "AGC decay: %.1f s" % (kiwi_snd.decay/1000)
+            elif "panorama" == show_bigmsg:
+                msg_text = ("Panorama %.0f-%.0f kHz, %.2f kHz/bin" % (panorama.start_khz, panorama.end_khz, panorama.bin_khz)) if fl.show_panorama_flag else "Panorama OFF"
+            elif "spectrum_avg" == show_bigmsg:
+                msg_text = "Spectrum: " + {"boxcar": "AVERAGE", "exp": "EXP AVERAGE", "peak": "PEAK HOLD"}[kiwi_wf.spectrum_avg.mode]
+
+            disp.display_msg_box(sdrdisplay, msg_text, pos=pos, color=msg_color)
+
+        if fl.s_meter_show_flag:
+            smeter_surface = disp.s_meter_draw(rssi_smooth, rssi_smooth_slow, kiwi_snd.thresh, kiwi_snd.decay)
+            sdrdisplay.blit(smeter_surface, (0, disp.BOTTOMBAR_Y-(disp.s_meter_radius+disp.BOTTOMBAR_HEIGHT)))
+
+        sdrdisplay.set_clip(None)
+        pygame.display.update(dirty_rect)
+        regions.clear()
 
     mouse = pygame.mouse.get_pos()
-    pygame.display.flip()
-    clock.tick(FPS)
+    frame_ms = clock.tick(FPS)
 
     if cat_radio and not cat_radio.cat_ok:
         cat_radio = None
@@ -1086,6 +1153,12 @@ if kiwi_snd2:
     except:
         pass
 
+for stream in [kiwi_snd, kiwi_snd2, kiwi_wf]:
+    if stream:
+        supervisor.unwatch(stream)
+if panorama:
+    panorama.close()
+
 kiwi_snd.terminate = True
 if kiwi_snd2:
     kiwi_snd2.terminate = True
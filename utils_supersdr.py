@@ -4,12 +4,15 @@ import array
 import math
 from collections import deque, defaultdict
 import pickle
-import threading, queue
+import threading
 import socket
+import selectors
+import asyncio
 import time
 from datetime import datetime, timedelta
 import sys
-import urllib
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 if sys.version_info > (3,):
     buffer = memoryview
     def bytearray2str(b):
@@ -19,7 +22,7 @@ else:
         return str(b)
 
 import numpy as np
-from scipy.signal import resample_poly, welch
+from scipy.signal import welch
 
 import sounddevice as sd
 import wave
@@ -32,6 +35,8 @@ import pygame, pygame.font, pygame.event, pygame.draw, string, pygame.freetype
 from qrz_utils import *
 
 from kiwi import wsclient
+from kiwi.client import ImaAdpcmDecoder
+from kiwi.connection import KiwiConnection
 import mod_pywebsocket.common
 from mod_pywebsocket.stream import Stream
 from mod_pywebsocket.stream import StreamOptions
@@ -51,6 +56,8 @@ HIGHLOW_CUT_AM = 6000 # Bandpass AM
 delta_low, delta_high = 0., 0. # bandpass tuning
 default_kiwi_port = 8073
 default_kiwi_password = ""
+CONNECT_TIMEOUT_S = 5 # Kiwi stream connection and setup, until the first data frame
+READ_TIMEOUT_S = 5 # bounds the sends, the reactor thread only reads from readable sockets
 
 # predefined RGB colors
 GREY = (200,200,200)
@@ -78,7 +85,7 @@ HELP_MESSAGE_LIST = ["SuperSDR %s HELP" % VERSION,
         "- U/L/C/A: switch to USB, LSB, CW, AM",
         "- J/K/O: tune RX low/high cut (SHIFT inverts, try CTRL!), O resets",
         "- CTRL+O: reset window size to native 1024 bins",
-        "- G/H: inc/dec spectrum and WF averaging to improve SNR",
+        "- G/H: inc/dec spectrum and WF averaging to improve SNR (SHIFT+G: dB/power avg)",
         "- ,/.(+SHIFT) change high(low) clip level for spectrum and WF",
         "- E: start/stop audio recording",
         "- F: enter frequency with keyboard",
@@ -97,13 +104,21 @@ HELP_MESSAGE_LIST = ["SuperSDR %s HELP" % VERSION,
         "- Q: switch to a different KIWI server",
         "- 1/2 & 3: adjust AGC threshold (+SHIFT decay), 3 WF autoscale",
         "- 0/9: [LOGGER] add QSO to log / open search QSO dialog",
-        "- 4: enable/disable spectrum filling",
+        "- 4: enable/disable spectrum filling (+SHIFT: avg/exp/peak spectrum)",
         "- 5/6: pan audio left/right for active RX",
+        "- P: show/hide the stitched panorama (needs --panorama)",
         "- SHIFT+ESC: quits"]
 
 font_size_dict = {"small": 12, "medium": 16, "big": 18}
 
 pygame.init()
+WF_LINE_EVENT = pygame.USEREVENT + 1 # posted by the W/F thread when a new line is ready
+# UI timers run on the clock, loop passes are event driven and unevenly spaced
+SLOW_UPDATE_S = 0.7 # refresh period of the slow readouts (S-meter peak, buffers, W/F levels)
+BLINK_S = 0.5
+
+def blink_on():
+    return int(time.monotonic()/BLINK_S) % 2
 
 nanofont = pygame.freetype.Font("TerminusTTF-4.49.1.ttf", 10)
 microfont = pygame.freetype.Font("TerminusTTF-4.49.1.ttf", 12)
@@ -123,6 +138,7 @@ class flags():
     show_eibi_flag = False
     show_mem_flag = True
     show_dxcluster_flag = False
+    show_panorama_flag = False
     connect_dxcluster_flag = False
     input_callsign_flag = False
     input_qso_flag = False
@@ -189,6 +205,7 @@ class dxcluster():
         self.terminate = False
         self.failed_counter = 0
         self.update_now = False
+        self.kiwi_wf = None # the spots are filtered with its span, the UI replaces it on a server switch
 
     def disconnect(self):
         self.terminate = True
@@ -266,7 +283,7 @@ class dxcluster():
             del self.spot_dict[spot_id]
         print("Number of spots in memory:", len(self.spot_dict.keys()))
 
-    def run(self, kiwi_wf):
+    def run(self):
         self.connect()
         while not self.terminate:
             try:
@@ -295,6 +312,7 @@ class dxcluster():
                 # print("DXCLUST: cleaned old spots")
             delta_t = (datetime.utcnow() - self.last_update).total_seconds()
             if delta_t > self.UPDATE_TIME or self.update_now:
+                kiwi_wf = self.kiwi_wf
                 self.get_stations(kiwi_wf.start_f_khz, kiwi_wf.end_f_khz)
                 # print("DXCLUST: updated visible spots")
                 self.last_update = datetime.utcnow()
@@ -348,6 +366,222 @@ class filtering():
         return filtered_sig
 
 
+class polyphase_resampler():
+    # stateful rational resampler fs_in -> fs_out, the zero stuffed samples are never multiplied
+    MAX_PHASES = 256
+    MAX_SEGMENTS = 16 # a skewed block is split in at most this many runs of constant speed
+
+    def __init__(self, fs_in, fs_out, max_out, dtype=np.float64, min_phases=1):
+        gcd = np.gcd(int(fs_in), int(fs_out))
+        self.up, self.down = int(fs_out)//gcd, int(fs_in)//gcd
+        if self.up > self.MAX_PHASES: # odd rates: nearest ratio with a bounded number of phases
+            self.up = self.MAX_PHASES
+            self.down = int(round(fs_in * self.up / fs_out))
+        elif self.up < min_phases: # finer time steps for skew, a phase step is a fraction of an input sample
+            k = -(-min_phases // self.up)
+            self.up, self.down = self.up*k, self.down*k
+        # prototype lowpass at the upsampled rate, split into up phases of n_tap coefficients
+        h = filtering(min(fs_in, fs_out)/2, fs_in*self.up).h * self.up
+        self.n_tap = int(np.ceil(len(h) / self.up))
+        h = np.concatenate([h, np.zeros(self.n_tap*self.up - len(h))])
+        self.phases = h.reshape(self.n_tap, self.up).T[:,::-1].astype(dtype) # oldest input sample first
+
+        # preallocated work buffers: no allocation when processing
+        self.max_out = max_out
+        self.max_in = self.inputs_needed(max_out, pos=4*self.up) + 1 # room for a few input samples of skew
+        self.hist = self.n_tap + 4 # history, a few more samples than the filter for negative skew
+        self.x = np.zeros(self.hist + self.max_in, dtype=dtype) # history, then new input
+        self.samples = np.zeros((max_out, self.n_tap), dtype=dtype)
+        self.idx = np.zeros((max_out, self.n_tap), dtype=np.int64)
+        self.ones = np.ones(self.n_tap, dtype=dtype)
+
+        # the phase sequence repeats every up/g outputs: input windows and coefficients are tabulated once
+        # for blocks starting at times 0..g-1, any other start is a table, a row offset and an input shift
+        self.g = int(np.gcd(self.up, self.down)) # > 1 only with min_phases, skew reaches the other residues
+        period = self.up // self.g
+        t = np.arange(self.g)[:,None] + np.arange(max_out + period, dtype=np.int64) * self.down
+        self.base_n, base_p = t // self.up, t % self.up
+        # the window of the n-th new sample ends at x[hist+n]
+        self.base_idx = self.base_n[:,:,None] + np.arange(self.hist-self.n_tap+1, self.hist+1)
+        self.base_coeffs = self.phases[base_p]
+        self.phase_row = np.zeros(self.up, dtype=np.int64)
+        for f in range(self.g):
+            self.phase_row[base_p[f,:period]] = np.arange(period)
+        self.pos = 0 # next output time in 1/up input samples, 0 is the first new input sample
+
+    def segments(self, skew):
+        return max(1, min(abs(skew), self.MAX_SEGMENTS))
+
+    def inputs_needed(self, n_out, pos=None, skew=0):
+        pos = self.pos if pos is None else pos
+        n_seg = self.segments(skew)
+        return max(0, (pos + skew*(n_seg-1)//n_seg + (n_out-1)*self.down) // self.up + 1)
+
+    def process(self, x, out, skew=0):
+        # resample exactly inputs_needed(len(out), skew=skew) input samples into out
+        # skew (in 1/up input samples) stretches the block: it is spread in equal steps over runs of the block,
+        # one phase per step when small, so the playout speed can be trimmed without audible jumps
+        n_out, n_in = len(out), len(x)
+        self.x[self.hist:self.hist+n_in] = x
+        n_seg = self.segments(skew)
+        for i in range(n_seg):
+            start, end = n_out*i//n_seg, n_out*(i+1)//n_seg
+            q, r = divmod(self.pos + skew*i//n_seg + start*self.down, self.up)
+            f, row = r % self.g, self.phase_row[r]
+            samples, idx = self.samples[start:end], self.idx[start:end]
+            np.add(self.base_idx[f,row:row+end-start], q - self.base_n[f,row], out=idx)
+            np.take(self.x, idx, out=samples, mode="clip") # "raise" would buffer out
+            np.multiply(samples, self.base_coeffs[f,row:row+end-start], out=samples)
+            np.matmul(samples, self.ones, out=out[start:end]) # row sums, much faster than sum(axis=1) on short rows
+        # keep the last input samples as history
+        self.x[:self.hist] = self.x[n_in:n_in+self.hist]
+        self.pos += n_out*self.down + skew - n_in*self.up
+        return out
+
+
+class sample_ring():
+    # single producer / single consumer audio ring: only the producer moves head, only the consumer moves tail
+    # counters grow forever, fill is head - tail and the buffer index is counter % capacity
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self.buf = np.zeros(capacity, dtype=dtype)
+        self.head, self.tail = 0, 0
+
+    def fill(self):
+        return self.head - self.tail
+
+    def free(self):
+        return self.capacity - (self.head - self.tail)
+
+    def write(self, x):
+        # all or nothing, False when there is no room
+        n = len(x)
+        if n > self.free():
+            return False
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start+first] = x[:first]
+        self.buf[:n-first] = x[first:]
+        self.head += n # publish only after the samples are in place
+        return True
+
+    def read(self, out):
+        # exactly len(out) samples or nothing, never waits
+        n = len(out)
+        if n > self.fill():
+            return False
+        start = self.tail % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buf[start:start+first]
+        out[first:] = self.buf[:n-first]
+        self.tail += n
+        return True
+
+    def skip(self, n, fade):
+        # consumer side: drop n samples, the next ones are crossfaded from the dropped ones over len(fade)
+        m = max(0, min(len(fade), self.fill() - n))
+        dropped = np.take(self.buf, np.arange(self.tail, self.tail+m), mode="wrap")
+        kept = np.arange(self.tail+n, self.tail+n+m) % self.capacity
+        self.buf[kept] = dropped + fade[:m] * (self.buf[kept] - dropped)
+        self.tail += n
+
+
+def resized_ring(wf_data, head, rows, bins):
+    # new waterfall ring with the newest lines of the old one (if any) from row 0, the new head
+    new_data = np.zeros((rows, bins), dtype=np.uint8)
+    if wf_data is not None and wf_data.shape[1] == bins:
+        kept = min(rows, len(wf_data))
+        new_data[:kept] = np.take(wf_data, head + np.arange(kept), axis=0, mode="wrap")
+    return new_data
+
+
+class quantile_tracker():
+    # streaming histogram over the 256 raw W/F levels, percentiles without sorting
+    MIN_WEIGHT = 1e-2 # decayed counts below this are dropped so old peaks fade out
+
+    def __init__(self, decay=0., n_levels=256):
+        self.decay = decay # 0 -> only the last update counts
+        self.hist = np.zeros(n_levels)
+
+    def reset(self):
+        self.hist[:] = 0
+
+    def update(self, levels):
+        counts = np.bincount(levels, minlength=len(self.hist))
+        if self.decay > 0:
+            self.hist *= self.decay
+            self.hist[self.hist < self.MIN_WEIGHT] = 0
+            self.hist += counts
+        else:
+            self.hist[:] = counts
+
+    def percentile(self, p):
+        # lowest level with at least p percent of the (weighted) counts at or below it
+        cumulative = np.cumsum(self.hist)
+        if p <= 0:
+            return int(np.searchsorted(cumulative, 0, side="right"))
+        return int(np.searchsorted(cumulative, cumulative[-1] * p / 100.))
+
+
+class spectrum_averager():
+    # incremental spectrum average fed one W/F line at a time, read as a single vector. The reactor thread
+    # pushes while the UI reads and changes the mode, the lock keeps them from seeing a half updated sum
+    MODES = ["boxcar", "exp", "peak"]
+    PEAK_DECAY = 1. # peak hold decay in levels per line
+
+    def __init__(self, n_bins, n_avg=15, mode="boxcar"):
+        self.n_avg = n_avg
+        self.mode = mode
+        self.ring = np.zeros((n_avg, n_bins), dtype=np.uint8)
+        self.ring_sum = np.zeros(n_bins, dtype=np.int32)
+        self.state = np.zeros(n_bins, dtype=np.float32)
+        self.alpha = 2. / (n_avg + 1) # same center of mass as the boxcar
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.clear()
+
+    def clear(self):
+        self.ring[:] = 0
+        self.ring_sum[:] = 0
+        self.state[:] = 0
+        self.index, self.count = 0, 0
+
+    def next_mode(self):
+        with self.lock:
+            self.mode = self.MODES[(self.MODES.index(self.mode)+1) % len(self.MODES)]
+            self.clear()
+        return self.mode
+
+    def push(self, line):
+        with self.lock:
+            self.update(line)
+
+    def update(self, line):
+        if self.mode == "boxcar":
+            # running sum: remove the oldest line, add the new one
+            self.ring_sum -= self.ring[self.index]
+            self.ring[self.index] = line
+            self.ring_sum += self.ring[self.index]
+            self.index = (self.index + 1) % self.n_avg
+        elif self.count == 0:
+            self.state[:] = line
+        elif self.mode == "exp":
+            self.state += self.alpha * (line - self.state)
+        else:
+            self.state -= self.PEAK_DECAY
+            np.maximum(self.state, line, out=self.state)
+        self.count = min(self.count + 1, self.n_avg)
+
+    def get(self):
+        with self.lock:
+            if self.mode == "boxcar":
+                return self.ring_sum / max(self.count, 1)
+            return self.state.copy()
+
+
 class memory():
     def __init__(self):
         self.mem_list = deque([], 10)
@@ -392,6 +626,8 @@ class memory():
 
 
 class kiwi_list():
+    POLL_MS = 250
+
     def __init__(self):
         self.kiwi_list_filename = "kiwi.list"
         self.kiwi_host = ""
@@ -400,6 +636,9 @@ class kiwi_list():
         self.default_port = 8073
         self.default_password = ""
         self.connect_new_flag = False
+        self.display_list = []
+        self.prober = kiwi_prober()
+        self.poll_id = None # pending tk after() of the probe poll
 
         try:
             self.load_from_disk()
@@ -444,7 +683,7 @@ class kiwi_list():
                 try:
                     port = int(fields[1])
                 except:
-                    self.default_port
+                    port = self.default_port
                 password = fields[2] if col_count>1 else ""
                 comments = fields[3] if col_count>2 else ""
                 self.kiwi_list.append((host, port, password, comments))
@@ -454,8 +693,9 @@ class kiwi_list():
 
     def choose_kiwi_dialog(self):
         self.root = tkinter.Tk()
+        self.poll_id = None
         self.root.protocol("WM_DELETE_WINDOW", self.root.destroy)
-        self.root.geometry("400x400+960+450")
+        self.root.geometry("520x400+960+450")
         self.root.resizable(False,False)
         self.root.title("Choose a KiwiSDR")
         self.root.bind('<Escape>', lambda event: self.root.destroy())
@@ -477,7 +717,7 @@ class kiwi_list():
         frame_text = tkinter.Frame(self.root, borderwidth=1)
         frame_text.pack(fill=BOTH, expand=True)
         scrollbar = Scrollbar(frame_text)
-        self.t = tkinter.Text(frame_text, height=15, width=55, yscrollcommand=scrollbar.set)
+        self.t = tkinter.Text(frame_text, height=15, width=70, yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.t.yview)         
         scrollbar.pack(side=RIGHT, fill=Y)
         self.t.pack(side="left")
@@ -496,21 +736,48 @@ class kiwi_list():
         frame_bottom.pack()
         print(self.kiwi_list)
         self.refresh_list()
+        self.start_probe()
+
+    def start_probe(self):
+        # the probe runs on worker threads, the dialog polls it from the tk loop
+        self.prober.start([(kiwi_record[0], kiwi_record[1]) for kiwi_record in self.kiwi_list])
+        self.schedule_poll()
 
+    def schedule_poll(self):
+        # a single poll chain: a pending poll is replaced, never doubled
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+        self.poll_id = self.root.after(self.POLL_MS, self.poll_probe)
+
+    def poll_probe(self):
+        self.poll_id = None
+        try:
+            if self.prober.take_updated():
+                self.refresh_list()
+            if self.prober.running:
+                self.schedule_poll()
+        except TclError:
+            pass # dialog closed
 
     def refresh_list(self):
+        # best hosts first, the index typed by the user refers to this order
+        self.display_list = self.prober.ranked(self.kiwi_list)
+        top = self.t.yview()[0]
         self.t.configure(state='normal')
         self.t.delete(1.0, END)
-        for idx, kiwi_record in enumerate(self.kiwi_list):
-            kiwi_record = [str(el) for el in kiwi_record]
-            kiwi_string = ":".join(kiwi_record)+"\n"
-            kiwi_string = "%d. "%idx + kiwi_string
+        for idx, kiwi_record in enumerate(self.display_list):
+            kiwi_string = ":".join([str(el) for el in kiwi_record])
+            kiwi_string = "%d. "%idx + kiwi_string + " " + self.prober.describe(kiwi_record[0], kiwi_record[1]) + "\n"
             self.t.insert(END, kiwi_string)
         self.t.configure(state='disabled')
+        self.t.yview_moveto(top)
+        title = "Choose a KiwiSDR (probing...)" if self.prober.running else "Choose a KiwiSDR"
+        self.root.title(title)
 
     def reload_and_refresh(self):
         self.load_from_disk()
         self.refresh_list()
+        self.start_probe()
 
         
     def connect_new_kiwi(self, save_flag=False):
@@ -518,12 +785,12 @@ class kiwi_list():
         self.kiwi_port = None
         self.kiwi_password = None
         self.kiwi_data = self.entry_kiwi.get()
-        if len(self.kiwi_data)<3: # user has chosen a number
+        if self.kiwi_data.strip().isdigit(): # user has chosen a number
             try:
                 idx = int(self.kiwi_data)
-                self.kiwi_host = self.kiwi_list[idx][0]
-                self.kiwi_port = self.kiwi_list[idx][1]
-                self.kiwi_password = self.kiwi_list[idx][2]
+                self.kiwi_host = self.display_list[idx][0]
+                self.kiwi_port = self.display_list[idx][1]
+                self.kiwi_password = self.display_list[idx][2]
                 self.connect_new_flag = True
                 self.root.destroy()
             except:
@@ -547,8 +814,175 @@ class kiwi_list():
                     self.save_to_disk()
 
 
+class kiwi_status_cache():
+    # /status of each Kiwi (host, port), fetched with a timeout and kept for TTL_S seconds
+    # entries older than REFRESH_S are returned as they are and refreshed in the background
+    TTL_S = 60
+    REFRESH_S = 15
+    TIMEOUT_S = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {} # (host, port) -> (monotonic time, status dict)
+        self.refreshing = set()
+
+    def fetch(self, host, port):
+        status = {}
+        url = "http://%s:%d/status" % (host, port)
+        with urllib.request.urlopen(url, timeout=self.TIMEOUT_S) as file:
+            for line in file:
+                decoded_line = line.decode("utf-8").rstrip()
+                if "=" in decoded_line:
+                    key, value = decoded_line.split("=", 1)
+                    status[key] = value
+        self.put(host, port, status)
+        return status
+
+    def put(self, host, port, status):
+        with self.lock:
+            self.entries[(host, port)] = (time.monotonic(), status)
+
+    def invalidate(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+    def refresh(self, host, port):
+        try:
+            self.fetch(host, port)
+        except Exception:
+            pass # keep the old entry until it expires
+        finally:
+            with self.lock:
+                self.refreshing.discard((host, port))
+
+    def get(self, host, port):
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+            age = time.monotonic() - entry[0] if entry else None
+            stale = age is not None and age > self.REFRESH_S and age <= self.TTL_S and key not in self.refreshing
+            if stale:
+                self.refreshing.add(key)
+        if age is None or age > self.TTL_S:
+            return self.fetch(host, port)
+        if stale:
+            threading.Thread(target=self.refresh, args=key, daemon=True).start()
+        return entry[1]
+
+kiwi_status = kiwi_status_cache() # shared by all the streams and dialogs
+
+
+class kiwi_prober():
+    # checks the /status of every listed Kiwi on a bounded pool of worker threads and ranks them,
+    # the last results are kept on disk so the list is ranked as soon as the dialog opens
+    WORKERS = 16
+    CONNECT_TIMEOUT_S = 3
+    CACHE_FILENAME = "kiwi.probe"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {} # (host, port) -> dict with ok, latency_ms, users, users_max, offline, active, bands, time
+        self.running = False
+        self.updated = False
+        self.load_from_disk()
+
+    def probe(self, host, port):
+        result = {"ok": False, "time": time.time(), "latency_ms": None, "users": None, "users_max": None,
+            "offline": None, "active": None, "bands": None}
+        try:
+            start = time.monotonic()
+            with socket.create_connection((host, port), timeout=self.CONNECT_TIMEOUT_S):
+                result["latency_ms"] = (time.monotonic() - start) * 1000
+            status = kiwi_status.fetch(host, port) # also primes the status cache for the connection
+            result["users"] = int(status.get("users", 0))
+            result["users_max"] = int(status.get("users_max", 0))
+            result["offline"] = status.get("offline", "no") != "no"
+            result["active"] = status.get("status", "active") in ["active", "private"]
+            bands = status.get("bands", "").split("-")
+            if len(bands) == 2:
+                result["bands"] = (float(bands[0]), float(bands[1]))
+            result["ok"] = True
+        except Exception as e:
+            result["error"] = str(e)
+        with self.lock:
+            self.results[(host, port)] = result
+            self.updated = True
+        return result
+
+    def probe_all(self, hosts):
+        try:
+            with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+                for host, port in hosts:
+                    pool.submit(self.probe, host, port)
+            self.save_to_disk()
+        finally:
+            with self.lock:
+                self.running = False
+                self.updated = True
+
+    def start(self, hosts):
+        hosts = list(dict.fromkeys(hosts)) # no duplicates, keep the order
+        with self.lock:
+            if self.running or not hosts:
+                return False
+            self.running = True
+        threading.Thread(target=self.probe_all, args=(hosts,), daemon=True).start()
+        return True
+
+    def take_updated(self):
+        with self.lock:
+            updated, self.updated = self.updated, False
+        return updated
+
+    def get(self, host, port):
+        with self.lock:
+            return self.results.get((host, port))
+
+    def rank_key(self, host, port):
+        # reachable with a free slot first, then full, then offline, then never probed, then unreachable
+        result = self.get(host, port)
+        if result is None:
+            return (3, 0, 0)
+        if not result["ok"]:
+            return (4, 0, 0)
+        if result["offline"] or not result["active"]:
+            return (2, 0, result["latency_ms"])
+        free = result["users_max"] - result["users"]
+        return (0 if free > 0 else 1, -free, result["latency_ms"])
+
+    def ranked(self, kiwi_list):
+        return sorted(kiwi_list, key=lambda kiwi_record: self.rank_key(kiwi_record[0], kiwi_record[1]))
+
+    def describe(self, host, port):
+        result = self.get(host, port)
+        if result is None:
+            return "[?]"
+        if not result["ok"]:
+            return "[unreachable]"
+        if result["offline"] or not result["active"]:
+            return "[offline %dms]" % result["latency_ms"]
+        bands = " %.0f-%.0fMHz" % (result["bands"][0]/1e6, result["bands"][1]/1e6) if result["bands"] else ""
+        return "[%d/%d users %dms%s]" % (result["users"], result["users_max"], result["latency_ms"], bands)
+
+    def save_to_disk(self):
+        with self.lock:
+            results = dict(self.results)
+        try:
+            with open(self.CACHE_FILENAME, "wb") as fd:
+                pickle.dump(results, fd)
+        except:
+            print("Cannot save kiwi probe cache!")
+
+    def load_from_disk(self):
+        try:
+            with open(self.CACHE_FILENAME, "rb") as fd:
+                self.results = pickle.load(fd)
+        except:
+            self.results = {}
+
+
+
 class kiwi_sdr():
-    kiwi_status_dict = {}
     active = True
     offline = False
     users = 0
@@ -561,13 +995,7 @@ class kiwi_sdr():
     min_freq, max_freq = None, None
 
     def __init__(self, host, port, verbose_flag=False):
-        url = "http://%s:%d/status" % (host, port)
-        file = urllib.request.urlopen(url)
-        for line in file:
-            decoded_line = line.decode("utf-8").rstrip()
-            # print(decoded_line)
-            key, value = decoded_line.split("=")[0], decoded_line.split("=")[1]
-            self.kiwi_status_dict[key] = value
+        self.kiwi_status_dict = kiwi_status.get(host, port)
         
         self.users = int(self.kiwi_status_dict["users"])
         self.users_max = int(self.kiwi_status_dict["users_max"])
@@ -589,6 +1017,284 @@ class kiwi_sdr():
         if verbose_flag:
             print (self.kiwi_status_dict)
 
+class keepalive_scheduler():
+    # every command to the Kiwi goes through send(): the server only needs to hear from a connection
+    # now and then, so any SET command counts as a keepalive and "SET keepalive" is only sent to idle streams
+    INTERVAL_S = 10. # well inside the Kiwi server inactivity timeout
+
+    def __init__(self):
+        self.lock = threading.Lock() # guards the tables, never held while sending
+        self.send_locks = {} # owner -> lock, the UI and the I/O threads all send, frames must not interleave
+        self.last_sent = {}
+
+    def send(self, owner, stream, msg):
+        # a slow socket only blocks the senders of its own stream
+        with self.lock:
+            send_lock = self.send_locks.setdefault(owner, threading.Lock())
+        with send_lock:
+            stream.send_message(msg)
+        with self.lock:
+            self.last_sent[owner] = time.monotonic()
+
+    def due(self, owner, now):
+        return now - self.last_sent.get(owner, 0.) >= self.INTERVAL_S
+
+    def timeout(self, owners, now):
+        # seconds until the next keepalive is due
+        if not owners:
+            return self.INTERVAL_S
+        return max(0., min(self.last_sent.get(o, 0.) for o in owners) + self.INTERVAL_S - now)
+
+    def forget(self, owner):
+        with self.lock:
+            self.last_sent.pop(owner, None)
+            self.send_locks.pop(owner, None)
+
+keepalives = keepalive_scheduler() # shared by all the Kiwi streams
+
+
+class kiwi_reactor():
+    # one I/O thread for all the Kiwi websockets: a selector waits on every socket, the stream's on_readable()
+    # does one read and dispatches the complete messages, keepalives only go to streams idle for a while
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = [] # (add|remove, stream, done event), applied by the reactor thread between selects
+        # writing to the wakeup socket interrupts select when streams are added or removed
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.streams = []
+        self.sockets = {} # stream -> registered socket, a reconnecting stream replaces its own
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def wakeup(self):
+        try:
+            self.wake_w.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def add(self, stream):
+        # stream: kiwi_waterfall, with socket, on_readable(), keepalive() and terminate
+        stream.reactor = self
+        with self.lock:
+            self.pending.append(("add", stream, None))
+        self.wakeup()
+
+    def remove(self, stream):
+        # the socket is out of the selector when this returns, it can then be closed. The reactor thread never
+        # waits on a socket, it gets to the pending removal within one message dispatch
+        done = threading.Event()
+        with self.lock:
+            self.pending.append(("remove", stream, done))
+        if threading.current_thread() is self.thread:
+            self.apply_pending()
+        else:
+            self.wakeup()
+            while not done.wait(READ_TIMEOUT_S) and self.thread.is_alive():
+                pass
+        stream.reactor = None
+
+    def apply_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for op, stream, done in pending:
+            if op == "add" and stream not in self.streams:
+                self.selector.register(stream.socket, selectors.EVENT_READ, stream)
+                self.sockets[stream] = stream.socket
+                self.streams.append(stream)
+            elif op == "remove" and stream in self.streams:
+                self.drop(stream)
+            if done:
+                done.set()
+
+    def drop(self, stream):
+        self.selector.unregister(self.sockets.pop(stream))
+        self.streams.remove(stream)
+        keepalives.forget(stream)
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select(keepalives.timeout(self.streams, time.monotonic())):
+                stream = key.data
+                if stream is None:
+                    try:
+                        while self.wake_r.recv(512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif stream in self.streams and not stream.terminate:
+                    try:
+                        stream.on_readable()
+                    except Exception as e:
+                        print("stream error: %s" % e)
+                        stream.terminate = True
+            self.apply_pending()
+            # closed or terminated streams leave the selector, their owner closes the socket
+            for stream in [s for s in self.streams if s.terminate]:
+                self.drop(stream)
+            now = time.monotonic()
+            for stream in self.streams:
+                if keepalives.due(stream, now):
+                    try:
+                        stream.keepalive()
+                    except Exception as e:
+                        print("keepalive failed: %s" % e)
+
+
+class kiwi_event_loop():
+    # asyncio counterpart of kiwi_reactor for the streams on a KiwiConnection: one thread runs the event loop,
+    # each added stream gets a task awaiting its messages for on_message() and one sending its keepalives
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.tasks = {} # stream -> (reader, keepalive) tasks, only touched by the loop thread
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        # from another thread: the result of a coroutine run on the loop
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def add(self, stream):
+        # stream: kiwi_sound, with stream (a KiwiConnection), on_message(), keepalive() and terminate
+        stream.reactor = self
+        self.loop.call_soon_threadsafe(self.start_tasks, stream)
+
+    def start_tasks(self, stream):
+        if stream not in self.tasks:
+            self.tasks[stream] = (self.loop.create_task(self.read(stream)), self.loop.create_task(self.keep_alive(stream)))
+
+    def remove(self, stream):
+        # no message reaches the stream once this returns, its connection can then be closed
+        if threading.current_thread() is self.thread:
+            self.drop(stream)
+        else:
+            self.run(self.stop_tasks(stream))
+        stream.reactor = None
+
+    async def stop_tasks(self, stream):
+        tasks = self.drop(stream)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def drop(self, stream):
+        tasks = [task for task in self.tasks.pop(stream, ()) if task is not asyncio.current_task(self.loop)]
+        for task in tasks:
+            task.cancel()
+        keepalives.forget(stream)
+        return tasks
+
+    async def read(self, stream):
+        try:
+            while not stream.terminate:
+                msg = await stream.stream.receive_message()
+                stream.last_rx = time.monotonic()
+                stream.on_message(msg)
+        except Exception as e:
+            print("stream error: %s" % e)
+            stream.terminate = True
+        # like the reactor, a terminated stream is left alone until its owner closes or reconnects it
+        self.drop(stream)
+
+    async def keep_alive(self, stream):
+        while True:
+            await asyncio.sleep(keepalives.timeout([stream], time.monotonic()))
+            if keepalives.due(stream, time.monotonic()):
+                try:
+                    stream.keepalive()
+                except Exception as e:
+                    print("keepalive failed: %s" % e)
+
+kiwi_loop = kiwi_event_loop() # runs the SND streams
+
+
+class kiwi_supervisor():
+    # reconnects the Kiwi streams that died or went silent, with exponential backoff and jitter like
+    # KiwiWorker does for KiwiSDRStream. The stream objects are reused: the waterfall history and the user
+    # settings survive the gap, the first attempt is immediate
+    CHECK_S = 0.1
+    STALL_S = READ_TIMEOUT_S # no data for this long is a dead link, both streams deliver 10+ frames per second
+    BACKOFF_MIN_S = 0.25
+    BACKOFF_MAX_S = 30.
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.lock = threading.Lock()
+        self.streams = {} # stream -> (failed attempts, monotonic time of the next attempt)
+        self.homes = {} # stream -> reactor it is added back to
+        self.recovering = set()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def watch(self, stream, reactor=None):
+        # stream: kiwi_waterfall or kiwi_sound, with connect(), disconnect(), resend_settings() and last_rx.
+        # It goes back to the reactor or event loop it was added to
+        stream.supervisor = self
+        with self.lock:
+            self.streams[stream] = (0, 0.)
+            self.homes[stream] = reactor or stream.reactor or self.reactor
+
+    def unwatch(self, stream):
+        # before a stream is closed on purpose
+        with self.lock:
+            self.streams.pop(stream, None)
+            self.homes.pop(stream, None)
+        stream.supervisor = None
+
+    def backoff(self, attempts):
+        delay = min(self.BACKOFF_MAX_S, self.BACKOFF_MIN_S * 2**(attempts-1))
+        return random.uniform(delay/2, delay)
+
+    def run(self):
+        while True:
+            time.sleep(self.CHECK_S)
+            now = time.monotonic()
+            with self.lock:
+                streams = [(stream, attempts, next_try) for stream, (attempts, next_try) in self.streams.items() if stream not in self.recovering]
+            for stream, attempts, next_try in streams:
+                if not stream.terminate and now - stream.last_rx > self.STALL_S:
+                    print("%s:%d %s stream stalled" % (stream.host, stream.port, type(stream).__name__))
+                    stream.terminate = True
+                if stream.terminate and now >= next_try:
+                    with self.lock:
+                        self.recovering.add(stream)
+                    threading.Thread(target=self.recover, args=(stream, attempts), daemon=True).start()
+
+    def recover(self, stream, attempts):
+        with self.lock:
+            reactor = self.homes.get(stream, self.reactor)
+        try:
+            reactor.remove(stream)
+            stream.disconnect()
+            kiwi_status.invalidate(stream.host, stream.port) # the server may have restarted with other settings
+            try:
+                stream.connect()
+            except Exception as e:
+                stream.disconnect()
+                delay = self.backoff(attempts + 1)
+                print("%s:%d reconnection failed (%s), next attempt in %.1f s" % (stream.host, stream.port, e, delay))
+                with self.lock:
+                    if stream in self.streams:
+                        self.streams[stream] = (attempts + 1, time.monotonic() + delay)
+                return
+            with self.lock:
+                watched = stream in self.streams
+                if watched:
+                    self.streams[stream] = (0, 0.)
+            if not watched: # closed while reconnecting
+                stream.disconnect()
+                return
+            stream.terminate = False
+            stream.resend_settings() # what the user changed while the connection was being set up
+            reactor.add(stream)
+            print("%s:%d %s stream reconnected" % (stream.host, stream.port, type(stream).__name__))
+        finally:
+            with self.lock:
+                self.recovering.discard(stream)
+
+
 class kiwi_waterfall():
     MAX_FREQ = 30000
     CENTER_FREQ = int(MAX_FREQ/2)
@@ -597,11 +1303,19 @@ class kiwi_waterfall():
     MAX_FPS = 23
     MIN_DYN_RANGE = 40. # minimum visual dynamic range in dB
     CLIP_LOWP, CLIP_HIGHP = 40., 100 # clipping percentile levels for waterfall colors
+    AUTOSCALE_DECAY = 0.8 # memory of the auto scaling level histogram per line, 0 to disable
     delta_low_db, delta_high_db = 0, 0
     low_clip_db, high_clip_db = -120, -60 # tentative initial values for wf db limits
     wf_min_db, wf_max_db = low_clip_db, low_clip_db+MIN_DYN_RANGE
     kiwi_wf_timestamp = None
     wf_buffer_len = 3
+    compression = False # ADPCM compressed W/F stream
+    ws_deflate = False # permessage-deflate websocket compression, when the Kiwi accepts it
+    ADPCM_TAIL = 10 # decompression tail samples at the end of each compressed line
+    LEVEL_POWER = 10**(np.arange(256)/10.) # raw W/F level (1 dB steps) -> relative linear power
+    power_averaging = False # average W/F frames in linear power instead of dB
+    # user settings carried over to a new stream on server switch or reconnection
+    SETTINGS = ("averaging_n", "wf_auto_scaling", "delta_low_db", "delta_high_db", "power_averaging")
     
     def __init__(self, host_, port_, pass_, zoom_, freq_, eibi, disp):
         self.eibi = eibi
@@ -614,13 +1328,16 @@ class kiwi_waterfall():
         self.freq = freq_
         self.averaging_n = 1
         self.wf_auto_scaling = True
-        self.BINS2PIXEL_RATIO = disp.DISPLAY_WIDTH / self.WF_BINS
 
         self.old_averaging_n = self.averaging_n
         self.dynamic_range = self.MIN_DYN_RANGE
         
         self.wf_white_flag = False
         self.terminate = False
+        self.reactor = None
+        self.supervisor = None
+        self.panorama = None # kiwi_panorama taking the raw lines of this stream
+        self.last_rx = time.monotonic()
         self.run_index = 0
 
         if not self.freq:
@@ -642,10 +1359,44 @@ class kiwi_waterfall():
         # print ("Actual frequency:", self.actual_freq, "kHz")
         self.socket = None
         self.wf_stream = None
+        self.deflate = None
         self.wf_color = None
         self.freq_offset = 0
+        self.decoder = ImaAdpcmDecoder()
+        self.wf_lut = None # raw Kiwi byte -> palette index
+        self.wf_lut_key = None
+        self.wf_quantiles = quantile_tracker(self.AUTOSCALE_DECAY)
+
+        self.connect()
+                
+        self.bins_per_khz = self.WF_BINS / self.span_khz
+        self.wf_lock = threading.Lock() # the reactor writes the ring while the UI reads it
+        self.wf_lines = 0
+        self.wf_generation = 0
+        self.wf_data_tmp = deque([], self.wf_buffer_len)
+
+        # preallocated accumulators for W/F frames averaging
+        self.avg_acc = np.zeros(self.WF_BINS)
+        self.avg_tmp = np.zeros(self.WF_BINS)
+        self.avg_count, self.avg_target = 0, 1
+        self.spectrum_avg = spectrum_averager(self.WF_BINS) # WF_BINS may come from the server in connect()
 
-        kiwi_sdr_status = kiwi_sdr(host_, port_, True)
+        # without a display only the stream is set up, setup_display() must run before the reactor takes it
+        self.wf_data, self.wf_head = None, 0
+        if disp:
+            self.setup_display(disp)
+
+    def setup_display(self, disp):
+        # UI thread: pixel mapping and waterfall ring sized for the display, on resize the newest lines are kept
+        self.BINS2PIXEL_RATIO = disp.DISPLAY_WIDTH / self.WF_BINS
+        # circular waterfall history: wf_head is the newest line, older lines follow it and wrap around
+        with self.wf_lock:
+            self.wf_data, self.wf_head = resized_ring(self.wf_data, self.wf_head, disp.WF_HEIGHT, self.WF_BINS), 0
+            self.wf_generation += 1
+
+    def connect(self):
+        # socket, handshake and setup messages from the current settings, returns on the first W/F frame
+        kiwi_sdr_status = kiwi_sdr(self.host, self.port, True)
         print(kiwi_sdr_status.users, kiwi_sdr_status.users_max)
         if kiwi_sdr_status.users == kiwi_sdr_status.users_max:
             print ("Too many users!")
@@ -659,18 +1410,22 @@ class kiwi_waterfall():
         # connect to kiwi WF server
         print ("Trying to contact %s..."%self.host)
         try:
-            self.socket = socket.socket()
-            self.socket.connect((self.host, self.port))
+            self.socket = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT_S)
             print ("Socket open...")
         except:
             print ("Failed to connect")
             raise Exception()
         
+        self.wf_stream = None
         self.start_stream()
+        if not self.wf_stream:
+            raise Exception()
         
         while True:
             msg = self.wf_stream.receive_message()
             # print(msg)
+            if msg is None:
+                raise ConnectionTerminatedException("W/F stream closed during setup")
             if msg:
                 if bytearray2str(msg[0:3]) == "W/F":
                     break
@@ -687,12 +1442,8 @@ class kiwi_waterfall():
                     self.MAX_ZOOM = int(els[3].split("=")[1])
                     self.WF_BINS = int(els[0].split("=")[1])
                     self.MAX_FPS = int(els[2].split("=")[1])
-                
-        self.bins_per_khz = self.WF_BINS / self.span_khz
-        self.wf_data = np.zeros((disp.WF_HEIGHT, self.WF_BINS))
-        self.wf_data_tmp = deque([], self.wf_buffer_len)
-
-        self.avg_spectrum_deque = deque([], self.averaging_n)
+        self.socket.settimeout(READ_TIMEOUT_S)
+        self.last_rx = time.monotonic()
 
     def gen_div(self):
         self.space_khz = 10
@@ -721,7 +1472,7 @@ class kiwi_waterfall():
         uri = '/%d/%s' % (self.kiwi_wf_timestamp, 'W/F')
 
         try:
-            handshake_wf = wsclient.ClientHandshakeProcessor(self.socket, self.host, self.port)
+            handshake_wf = wsclient.ClientHandshakeProcessor(self.socket, self.host, self.port, use_permessage_deflate=self.ws_deflate)
             handshake_wf.handshake(uri)
             request_wf = wsclient.ClientRequest(self.socket)
         except:
@@ -730,6 +1481,9 @@ class kiwi_waterfall():
         stream_option_wf = StreamOptions()
         stream_option_wf.mask_send = True
         stream_option_wf.unmask_receive = False
+        self.deflate = handshake_wf.get_permessage_deflate_framer()
+        if self.deflate:
+            self.deflate.setup_stream_options(stream_option_wf) # inflate filters, before the stream is built
 
         self.wf_stream = Stream(request_wf, stream_option_wf)
         print(self.wf_stream)
@@ -737,11 +1491,11 @@ class kiwi_waterfall():
             print ("Waterfall data stream active...")
 
         # send a sequence of messages to the server, hardcoded for now
-        # max wf speed, no compression
+        # max wf speed, optional compression
         msg_list = ['SET auth t=kiwi p=%s ipl=%s'%(self.password, self.password), 'SET zoom=%d start=%d'%(self.zoom,self.counter),\
-        'SET maxdb=-10 mindb=-110', 'SET wf_speed=4', 'SET wf_comp=0', "SET interp=13"]
+        'SET maxdb=-10 mindb=-110', 'SET wf_speed=4', 'SET wf_comp=%d'%self.compression, "SET interp=13"]
         for msg in msg_list:
-            self.wf_stream.send_message(msg)
+            self.send_msg(msg)
         print ("Starting to retrieve waterfall data...")
 
     def zoom_to_span(self):
@@ -777,41 +1531,64 @@ class kiwi_waterfall():
         bins_per_khz_ = self.WF_BINS / self.span_khz
         return (1./bins_per_khz_) * (bins_)
 
-    def receive_spectrum(self):
-        msg = self.wf_stream.receive_message()
-        if msg and bytearray2str(msg[0:3]) == "W/F": # this is one waterfall line
+    def receive_spectrum(self, msg):
+        if msg is None:
+            self.terminate = True
+            print ('W/F server closed the connection')
+            return False
+        if bytearray2str(msg[0:3]) == "W/F": # this is one waterfall line
             msg = msg[16:] # remove some header from each msg AND THE FIRST BIN!
-            self.spectrum = np.ndarray(len(msg), dtype='B', buffer=msg).astype(np.float32) # convert from binary data
-            self.keepalive()
+            if self.compression:
+                self.decoder.__init__() # each compressed line starts from a fresh decoder state
+                samples = self.decoder.decode(msg)[:-self.ADPCM_TAIL]
+                self.spectrum = np.clip(samples, 0, 255).astype(np.uint8)
+            else:
+                self.spectrum = np.frombuffer(msg, dtype=np.uint8).copy() # raw bytes, 1 dB per level
+            return True
+        return False
 
-    def spectrum_db2col(self):
-        wf = self.spectrum
-        wf = -(255 - wf)  # dBm
-        wf_db = wf - 13 + (3*self.zoom) # typical Kiwi wf cal and zoom correction
-        wf_db[0] = wf_db[1] # first bin is broken
-        
-        if self.wf_auto_scaling:
-            # compute min/max db of the power distribution at selected percentiles
-            self.low_clip_db = np.percentile(wf_db, self.CLIP_LOWP)
-            self.high_clip_db = np.percentile(wf_db, self.CLIP_HIGHP)
-            self.dynamic_range = max(self.high_clip_db - self.low_clip_db, self.MIN_DYN_RANGE)
+    def level_to_db(self, level):
+        # raw Kiwi W/F byte to dBm with typical Kiwi wf cal and zoom correction
+        return -(255 - level) - 13 + (3*self.zoom)
 
+    def level_to_color(self, levels):
+        # palette index of float raw levels, averaged lines have fractional ones
+        wf_db = self.level_to_db(levels)
         # shift chosen min to zero
         wf_color_db = (wf_db - (self.low_clip_db+self.delta_low_db))
         # standardize the distribution between 0 and 1 (at least MIN_DYN_RANGE dB will be allocated in the colormap if delta=0)
         normal_factor_db = self.dynamic_range + self.delta_high_db
-        self.wf_color = wf_color_db / (normal_factor_db-self.delta_low_db)
+        wf_color = np.clip(wf_color_db / (normal_factor_db-self.delta_low_db), 0.0, 1.0)
+        # standardize again between 0 and 255
+        return (wf_color * 254).astype(np.uint8)
+
+    def make_wf_lut(self):
+        # palette index for each of the 256 possible raw levels
+        self.wf_lut = self.level_to_color(np.arange(256, dtype=np.float64))
+
+    def spectrum_db2col(self):
+        wf = self.spectrum
+        wf[0] = wf[1] # first bin is broken
+        
+        if self.wf_auto_scaling:
+            # compute min/max db of the power distribution at selected percentiles, in whole levels
+            self.wf_quantiles.update(wf if wf.dtype == np.uint8 else np.rint(wf).astype(np.uint8))
+            self.low_clip_db = self.level_to_db(self.wf_quantiles.percentile(self.CLIP_LOWP))
+            self.high_clip_db = self.level_to_db(self.wf_quantiles.percentile(self.CLIP_HIGHP))
+            self.dynamic_range = max(self.high_clip_db - self.low_clip_db, self.MIN_DYN_RANGE)
 
-        self.wf_color = np.clip(self.wf_color, 0.0, 1.0)
+        # the lookup table only changes with clip levels, deltas and zoom
+        lut_key = (self.low_clip_db, self.dynamic_range, self.delta_low_db, self.delta_high_db, self.zoom)
+        if lut_key != self.wf_lut_key:
+            self.make_wf_lut()
+            self.wf_lut_key = lut_key
+        # averaged lines skip the table: rounding them to whole levels would undo the averaging
+        self.wf_color = self.wf_lut[wf] if wf.dtype == np.uint8 else self.level_to_color(wf)
 
+        normal_factor_db = self.dynamic_range + self.delta_high_db
         self.wf_min_db = self.low_clip_db + self.delta_low_db - (3*self.zoom)
         self.wf_max_db = self.low_clip_db + normal_factor_db - (3*self.zoom)
 
-        # standardize again between 0 and 255
-        self.wf_color *= 254
-        # clip exceeding values
-        self.wf_color = np.clip(self.wf_color, 0, 255)
-
     def set_freq_zoom(self, freq_, zoom_):
         self.freq = freq_
         self.zoom = zoom_
@@ -837,19 +1614,58 @@ class kiwi_waterfall():
                 self.zoom_to_span()
         self.counter, actual_freq = self.start_frequency_to_counter(self.start_f_khz)
         msg = "SET zoom=%d start=%d" % (self.zoom, self.counter)
-        self.wf_stream.send_message(msg)
+        self.send_msg(msg)
+        self.wf_generation += 1
+        self.wf_quantiles.reset() # new span, forget the old level distribution
         self.eibi.get_stations(self.start_f_khz, self.end_f_khz)
         self.bins_per_khz = self.WF_BINS / self.span_khz
         self.gen_div()
 
         return self.freq
 
+    def send_msg(self, msg):
+        try:
+            keepalives.send(self, self.wf_stream, msg)
+        except Exception:
+            if not self.terminate:
+                raise # while reconnecting the setting is kept, resend_settings() sends it
+
+    def resend_settings(self):
+        self.send_msg("SET zoom=%d start=%d" % (self.zoom, self.counter))
+
+    def get_settings(self):
+        settings = {key: getattr(self, key) for key in self.SETTINGS}
+        settings["freq"], settings["zoom"] = self.freq, self.zoom
+        return settings
+
+    def restore_settings(self, settings):
+        for key in self.SETTINGS:
+            setattr(self, key, settings[key])
+        self.set_freq_zoom(settings["freq"], min(settings["zoom"], self.MAX_ZOOM))
+
+    def deflate_ratio(self):
+        # received / inflated bytes so far, None without permessage-deflate
+        return self.deflate.get_incoming_average_ratio() if self.deflate else None
+
     def keepalive(self):
-        self.wf_stream.send_message("SET keepalive")
+        self.send_msg("SET keepalive")
+
+    def disconnect(self):
+        # a dead link gets no closing handshake, only the socket is closed
+        try:
+            self.socket.close()
+        except Exception:
+            pass
 
     def close_connection(self):
+        if self.supervisor:
+            self.supervisor.unwatch(self)
         if not self.wf_stream:
             return
+        if self.reactor:
+            self.reactor.remove(self)
+        if self.deflate:
+            print ("W/F deflate ratio: %.2f" % self.deflate_ratio())
         try:
             self.wf_stream.close_connection(mod_pywebsocket.common.STATUS_GOING_AWAY)
             self.socket.close()
@@ -873,29 +1689,86 @@ class kiwi_waterfall():
         return lc_, hc_
 
     def set_white_flag(self):
-        self.wf_color = np.ones_like(self.wf_color)*255
-        self.wf_data[0,:] = self.wf_color
-
-    def run(self):
-        while not self.terminate:
-            if self.averaging_n>1:
-                self.avg_spectrum_deque = deque([], self.averaging_n)
-                for avg_idx in range(self.averaging_n):
-                    self.receive_spectrum()
-                    self.avg_spectrum_deque.append(self.spectrum)
-                self.spectrum = np.mean(self.avg_spectrum_deque, axis=0)
-            else:
-                self.receive_spectrum()
-            self.run_index += 1
+        self.wf_color = np.full_like(self.wf_color, 255)
+        with self.wf_lock:
+            self.wf_data[self.wf_head,:] = self.wf_color
+            self.wf_lines += 1
+        self.spectrum_avg.reset()
+        self.wf_generation += 1 # the top line changed in place, the display must rebuild the waterfall
+
+    def push_wf_line(self, wf_line):
+        # move the head one line up in the ring and overwrite the oldest line: O(WF_BINS)
+        with self.wf_lock:
+            head = (self.wf_head - 1) % len(self.wf_data)
+            self.wf_data[head,:] = wf_line
+            self.wf_head = head
+            self.wf_lines += 1 # lines count, tells the display a redraw is due
+        self.spectrum_avg.push(wf_line)
+
+    def notify_line(self):
+        # wake up the UI loop, one pending event is enough however many lines arrived
+        if not pygame.event.peek(WF_LINE_EVENT):
+            pygame.event.post(pygame.event.Event(WF_LINE_EVENT))
+
+    def get_lines(self, since=None):
+        # copy of the lines pushed after line count since, newest first, and the line count they bring the
+        # display to: the whole waterfall if since is None or too old
+        with self.wf_lock:
+            new_lines = self.wf_lines - since if since is not None else -1
+            if not 0 <= new_lines < len(self.wf_data):
+                new_lines = len(self.wf_data)
+            return np.take(self.wf_data, self.wf_head + np.arange(new_lines), axis=0, mode="wrap"), self.wf_lines
+
+    def accumulate_spectrum(self):
+        if self.power_averaging:
+            np.take(self.LEVEL_POWER, self.spectrum, out=self.avg_tmp)
+            self.avg_acc += self.avg_tmp
+        else:
+            self.avg_acc += self.spectrum
+
+    def averaged_spectrum(self, averaging_n):
+        # fractional levels, the sub dB resolution is what deep averaging is for
+        np.divide(self.avg_acc, averaging_n, out=self.avg_tmp)
+        if self.power_averaging:
+            np.log10(self.avg_tmp, out=self.avg_tmp)
+            self.avg_tmp *= 10
+        return np.clip(self.avg_tmp, 0, 255, out=self.avg_tmp)
+
+    def on_readable(self):
+        # from the reactor thread: one non-blocking read, then the messages completed by it.
+        # A frame cut short waits in the read-ahead buffer for the next read
+        self.wf_stream.read_available()
+        self.last_rx = time.monotonic()
+        for msg in self.wf_stream.receive_buffered_messages():
+            self.on_message(msg)
+            if self.terminate:
+                return
+
+    def on_message(self, msg):
+        # a line is made every averaging_n W/F frames
+        if not self.receive_spectrum(msg):
+            return
+        if self.avg_count == 0:
+            self.avg_target = self.averaging_n # averaging changes apply from the next line
+            self.avg_acc[:] = 0
+        if self.avg_target > 1:
+            self.accumulate_spectrum()
+            self.avg_count += 1
+            if self.avg_count < self.avg_target:
+                return
+            self.spectrum = self.averaged_spectrum(self.avg_target)
+            self.avg_count = 0
+        if self.panorama:
+            self.panorama.put_line(self) # the panorama colours and stores the stitched lines
+            return
+        self.run_index += 1
 
-            self.spectrum_db2col()
-            # print(len(self.wf_data_tmp))
-            self.wf_data_tmp.appendleft(self.wf_color)
+        self.spectrum_db2col()
+        self.wf_data_tmp.appendleft(self.wf_color)
 
-            if len(self.wf_data_tmp) > 0 and self.run_index > self.wf_buffer_len:
-                self.wf_data[1:,:] = self.wf_data[0:-1,:] # scroll wf array 1 line down
-                self.wf_data[0,:] = self.wf_data_tmp.pop() # overwrite top line with new data
-        return
+        if len(self.wf_data_tmp) > 0 and self.run_index > self.wf_buffer_len:
+            self.push_wf_line(self.wf_data_tmp.pop()) # new top line, no scrolling of the whole array
+            self.notify_line()
 
 
 class kiwi_sound():
@@ -904,9 +1777,21 @@ class kiwi_sound():
     CHANNELS = 2
     AUDIO_RATE = 48000
     KIWI_RATE = 12000
+    KIWI_RATE_TRUE = float(KIWI_RATE)
     SAMPLE_RATIO = int(AUDIO_RATE/KIWI_RATE)
     CHUNKS = 1
     KIWI_SAMPLES_PER_FRAME = 512
+    compression = False # ADPCM compressed SND stream
+    ws_deflate = False # permessage-deflate websocket compression, when the Kiwi accepts it
+    # adaptive playout: the buffer target follows the network jitter, the fill error trims the playout speed
+    JITTER_K = 4. # target latency in measured jitters, on top of one Kiwi frame and one audio block
+    FILL_GAIN = 0.1 # playout speed correction per second of fill error (10 s time constant)
+    MAX_TRIM = 0.002 # fastest speed correction, 0.2% is about 3.5 cents, it only has to follow the clock drift
+    CATCHUP_FRAMES = 2 # smoothed fill over the target by more than this: whole frames are dropped at once
+    CATCHUP_FADE = 64 # crossfade over the dropped frames, in Kiwi samples
+    # user settings carried over to a new stream on server switch or reconnection
+    SETTINGS = ("freq", "radio_mode", "lc", "hc", "volume", "audio_balance",
+        "on", "hang", "thresh", "slope", "decay_other", "decay_cw", "gain")
 
     def __init__(self, freq_, mode_, lc_, hc_, password_, kiwi_wf, buffer_len, volume_=100, host_=None, port_=None, subrx_=False):
         self.subrx = subrx_
@@ -915,7 +1800,6 @@ class kiwi_sound():
         self.host = host_ if host_ else kiwi_wf.host
         self.port = port_ if port_ else kiwi_wf.port
         self.FULL_BUFF_LEN = max(1, buffer_len)
-        self.audio_buffer = queue.Queue(maxsize = self.FULL_BUFF_LEN)
         self.terminate = False
         self.volume = volume_
         self.max_rssi_before_mute = -20
@@ -923,9 +1807,13 @@ class kiwi_sound():
         self.muting_delay = 15
         self.adc_overflow_flag = False
         self.status = None
+        self.reactor = None
+        self.supervisor = None
+        self.deflate = None
+        self.password = password_
+        self.standby = False # silent playout, the buffer still runs at its target
 
         self.run_index = 0
-        self.delta_t = 0.0
         
         self.rssi = -127
         self.freq = freq_
@@ -945,6 +1833,39 @@ class kiwi_sound():
         self.audio_balance = 0.0
         self.freq_offset = 0
 
+        self.connect()
+        
+        # Kiwi rate -> audio card rate, the callback pulls whole Kiwi frames until it has enough input
+        self.blocksize = int(self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS*self.SAMPLE_RATIO)
+        # float32 scratch buffers for the sounddevice callback, nothing is allocated while playing
+        self.resampler = polyphase_resampler(self.KIWI_RATE, self.AUDIO_RATE, self.blocksize, dtype=np.float32, min_phases=64)
+        self.pending = np.zeros(self.resampler.max_in, dtype=np.float32)
+        # Kiwi rate samples between the network thread and the callback, room for two more frames than the target
+        self.audio_ring = sample_ring((self.FULL_BUFF_LEN+2)*self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS)
+
+        # the audio buffer length option is the latency ceiling, the actual target starts half way
+        self.frame_s = self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS / self.KIWI_RATE_TRUE
+        self.block_s = self.blocksize / self.AUDIO_RATE
+        self.max_fill = self.FULL_BUFF_LEN*self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS
+        self.target_fill = self.max_fill / 2
+        self.target_latency_ms = 1000 * self.target_fill / self.KIWI_RATE_TRUE
+        self.jitter_s = 0.
+        self.fill_smooth = self.target_fill
+        self.clock_offset = self.KIWI_RATE_TRUE/self.KIWI_RATE - 1 # Kiwi ADC clock vs nominal rate
+        self.drift_acc = 0.
+        self.dropped_frames = 0
+        self.skipped_frames = 0
+        self.catchup_fade = np.linspace(0, 1, self.CATCHUP_FADE, dtype=np.float32)
+        self.buffering = True # silence until the target fill is reached, at start and after an underrun
+        self.resampled = np.zeros(self.blocksize, dtype=np.float32)
+        self.channel = np.zeros(self.blocksize, dtype=np.float32)
+
+        self.audio_rec = audio_recording(self)
+
+    def connect(self):
+        # socket, handshake and setup messages from the current settings, returns on the first SND frame
+        self.decoder = ImaAdpcmDecoder()
+        self.last_arrival = None # no jitter sample across a reconnection
         kiwi_sdr_status = kiwi_sdr(self.host, self.port)
         if kiwi_sdr_status.users == kiwi_sdr_status.users_max:
             print ("Too many users! Failed to connect!")
@@ -956,33 +1877,37 @@ class kiwi_sound():
             self.freq_offset = kiwi_sdr_status.freq_offset/1000.0
 
         print ("Trying to contact server...")
+        kiwi_wf = self.kiwi_wf
+        new_timestamp = int(time.time())
+        if new_timestamp - kiwi_wf.kiwi_wf_timestamp > 5:
+            kiwi_wf.kiwi_wf_timestamp = new_timestamp
+        uri = '/%d/%s' % (kiwi_wf.kiwi_wf_timestamp, 'SND')
         try:
-            self.socket = socket.socket()
-            self.socket.connect((self.host, self.port)) # future: allow different kiwiserver for audio stream
-            new_timestamp = int(time.time())
-            if new_timestamp - kiwi_wf.kiwi_wf_timestamp > 5:
-                kiwi_wf.kiwi_wf_timestamp = new_timestamp
-            uri = '/%d/%s' % (kiwi_wf.kiwi_wf_timestamp, 'SND')
-            handshake_snd = wsclient.ClientHandshakeProcessor(self.socket, self.host, self.port)
-            handshake_snd.handshake(uri)
-            request_snd = wsclient.ClientRequest(self.socket)
-            request_snd.ws_version = mod_pywebsocket.common.VERSION_HYBI13
-            stream_option_snd = StreamOptions()
-            stream_option_snd.mask_send = True
-            stream_option_snd.unmask_receive = False
-            self.stream = Stream(request_snd, stream_option_snd)
-            
+            kiwi_loop.run(self.open_stream(uri))
+        except:
+            print ("Failed to connect to Kiwi audio stream")
+            raise
+        self.last_rx = time.monotonic()
+
+    async def open_stream(self, uri):
+        # on the event loop, the connection is kept only once the first SND frame is in
+        password_ = self.password
+        self.stream = await KiwiConnection.open(self.host, self.port, uri, timeout=CONNECT_TIMEOUT_S, use_permessage_deflate=self.ws_deflate)
+        try:
+            self.deflate = self.stream.deflate
             print ("Audio data stream active...")
             msg_list = ["SET auth t=kiwi p=%s ipl=%s"%(password_, password_),
             "SET mod=%s low_cut=%d high_cut=%d freq=%.3f" % (self.radio_mode.lower(), self.lc, self.hc, self.freq), 
-            "SET compression=0", "SET ident_user=SuperSDR","SET OVERRIDE inactivity_timeout=1000",
+            "SET compression=%d"%self.compression, "SET ident_user=SuperSDR","SET OVERRIDE inactivity_timeout=1000",
             "SET agc=%d hang=%d thresh=%d slope=%d decay=%d manGain=%d" % (self.on, self.hang, self.thresh, self.slope, self.decay, self.gain),
             "SET AR OK in=%d out=%d" % (self.KIWI_RATE, self.AUDIO_RATE)]
             
             for msg in msg_list:
-                self.stream.send_message(msg)
+                self.send_msg(msg)
             while True:
-                msg = self.stream.receive_message()
+                msg = await asyncio.wait_for(self.stream.receive_message(), CONNECT_TIMEOUT_S)
+                if msg is None:
+                    raise ConnectionTerminatedException("SND stream closed during setup")
                 if msg and "SND" == bytearray2str(msg[:3]):
                     break
                 elif msg and "MSG audio_init" in bytearray2str(msg):
@@ -990,21 +1915,10 @@ class kiwi_sound():
                     els = msg[4:].split()                
                     self.KIWI_RATE = int(int(els[1].split("=")[1]))
                     self.KIWI_RATE_TRUE = float(els[2].split("=")[1])
-                    self.delta_t = self.KIWI_RATE_TRUE - self.KIWI_RATE
                     self.SAMPLE_RATIO = self.AUDIO_RATE/self.KIWI_RATE
         except:
-            print ("Failed to connect to Kiwi audio stream")
+            self.stream.abort()
             raise
-        
-        self.kiwi_filter = filtering(self.KIWI_RATE/2, self.AUDIO_RATE)
-        gcd = np.gcd((self.KIWI_RATE),self.AUDIO_RATE)
-        self.n_low, self.n_high = int(self.KIWI_RATE/gcd), int(self.AUDIO_RATE/gcd)
-
-        self.n_tap = self.kiwi_filter.n_tap
-        self.lowpass = self.kiwi_filter.lowpass
-        self.old_buffer = np.zeros((self.n_tap-1))
-
-        self.audio_rec = audio_recording(self)
 
     def change_agc_delay(self, delta):
         if delta < 0:
@@ -1021,46 +1935,26 @@ class kiwi_sound():
         
     def set_agc_params(self):
         msg = "SET agc=%d hang=%d thresh=%d slope=%d decay=%d manGain=%d" % (self.on, self.hang, self.thresh, self.slope, self.decay, self.gain)
-        self.stream.send_message(msg)
+        self.send_msg(msg)
 
     def set_mode_freq_pb(self):
         self.decay = self.decay_other if self.radio_mode != "CW" else self.decay_cw
         msg = 'SET mod=%s low_cut=%d high_cut=%d freq=%.3f' % (self.radio_mode.lower(), self.lc, self.hc, self.freq)
-        self.stream.send_message(msg)
+        self.send_msg(msg)
 
-    def get_audio_chunk(self):
+    def get_audio_chunk(self, data):
         try:
-            snd_buf = self.process_audio_stream()
+            snd_buf = self.process_audio_stream(data)
         except:
             self.terminate = True
             return
-
-        if snd_buf is not None:
-            self.keepalive()
-        else:
-            snd_buf = None
         return snd_buf
 
-    def process_audio_stream(self):
-        try:
-            data = self.stream.receive_message()
-            # if not self.run_index % 100:
-                # print(self.run_index, self.run_index * self.delta_t * self.KIWI_SAMPLES_PER_FRAME/self.KIWI_RATE)
-            if self.run_index * self.delta_t * self.KIWI_SAMPLES_PER_FRAME/self.KIWI_RATE >= self.KIWI_SAMPLES_PER_FRAME: # self.KIWI_SAMPLES_PER_FRAME:
-                # print("Double reading from server to compensate audio non integer sample rate!", self.run_index)
-                data = self.stream.receive_message()
-                self.run_index = 0
-            if data is None:
-                self.terminate = True
-                self.kiwi_wf.terminate = True
-                self.socket.close()
-                print ('server closed the connection cleanly')
-                raise
-        except ConnectionTerminatedException:
+    def process_audio_stream(self, data):
+        if data is None:
             self.terminate = True
-            self.kiwi_wf.terminate = True
-            print('server closed the connection unexpectedly')
-            raise
+            print ('server closed the connection cleanly')
+            return None
 
         if bytearray2str(data[0:3]) == "SND": # this is one waterfall line
             flags,seq, = struct.unpack('<BI', buffer(data[3:8]))
@@ -1068,8 +1962,11 @@ class kiwi_sound():
             s_meter, = struct.unpack('>H',  buffer(data[8:10]))
             self.rssi = (0.1 * s_meter - 127)
             data = data[10:]
-            count = len(data) // 2
-            samples = np.ndarray(count, dtype='>h', buffer=data).astype(np.int16)
+            if self.compression:
+                samples = self.decoder.decode(data) # decoder state is carried across frames
+            else:
+                count = len(data) // 2
+                samples = np.ndarray(count, dtype='>h', buffer=data).astype(np.int16)
 
             return samples
         else:
@@ -1091,51 +1988,102 @@ class kiwi_sound():
         self.lc, self.hc = lc_, hc_
         return lc_, hc_
 
+    def send_msg(self, msg):
+        try:
+            keepalives.send(self, self.stream, msg)
+        except Exception:
+            if not self.terminate:
+                raise # while reconnecting the setting is kept, resend_settings() sends it
+
+    def resend_settings(self):
+        self.set_mode_freq_pb()
+        self.set_agc_params()
+
+    def get_settings(self):
+        return {key: getattr(self, key) for key in self.SETTINGS}
+
+    def restore_settings(self, settings):
+        for key in self.SETTINGS:
+            setattr(self, key, settings[key])
+        self.set_mode_freq_pb()
+        self.set_agc_params()
+
+    def deflate_ratio(self):
+        # received / inflated bytes so far, None without permessage-deflate
+        return self.deflate.get_incoming_average_ratio() if self.deflate else None
+
     def keepalive(self):
-        self.stream.send_message("SET keepalive")
+        self.send_msg("SET keepalive")
+
+    def disconnect(self):
+        # a dead link gets no closing handshake, only the connection is dropped
+        try:
+            self.stream.abort()
+        except Exception:
+            pass
 
     def close_connection(self):
+        if self.supervisor:
+            self.supervisor.unwatch(self)
         if self.stream == None:
             return
+        if self.reactor:
+            self.reactor.remove(self)
+        if self.deflate:
+            print ("SND deflate ratio: %.2f" % self.deflate_ratio())
         try:
             self.stream.close_connection(mod_pywebsocket.common.STATUS_GOING_AWAY)
-            self.socket.close()
         except Exception as e:
             print ("exception: %s" % e)
     
     def play_buffer(self, outdata, frame_count, time_info, status):
         self.status = status
-        # play silence immediately after buffer underrun
-        # go on as usual if very short buffer chosen (local kiwis only!)
-        if self.late_flag:
-            try:
-                outdata[:] = self.old_outdata[:]*0 # insert silence with empty buffer
-            except:
-                pass
+        # silence while (re)buffering up to the adaptive target, then play continuously
+        fill = self.audio_ring.fill()
+        if self.buffering:
+            if fill < self.target_fill:
+                outdata.fill(0)
+                return
+            self.buffering = False
+
+        # latency left by a burst (network stall, reconnection) is dropped in whole frames, crossfaded:
+        # the speed trim alone would take minutes to drain it
+        self.fill_smooth += 0.1 * (fill - self.fill_smooth)
+        frame_len = self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS
+        if self.fill_smooth - self.target_fill > self.CATCHUP_FRAMES * frame_len:
+            skip = min(self.fill_smooth - self.target_fill, fill - self.target_fill) // frame_len * frame_len
+            if skip > 0:
+                self.audio_ring.skip(int(skip), self.catchup_fade)
+                self.skipped_frames += int(skip) // frame_len
+                self.fill_smooth -= skip
+                fill -= skip
+
+        # drift compensation by fractional resampling: the input consumed per block is stretched by the
+        # Kiwi clock offset plus a proportional correction of the fill error, spread over the block as phase steps
+        trim = self.FILL_GAIN * (self.fill_smooth - self.target_fill) / self.KIWI_RATE_TRUE
+        trim = min(max(trim, -self.MAX_TRIM), self.MAX_TRIM)
+        self.drift_acc += frame_count * self.resampler.down * (self.clock_offset + trim)
+        skew = int(self.drift_acc)
+        self.drift_acc -= skew
+
+        # exactly the input samples the resampler needs for this block, whatever the Kiwi frame boundaries
+        n_in = self.resampler.inputs_needed(frame_count, skew=skew)
+        if not self.audio_ring.read(self.pending[:n_in]):
+            outdata.fill(0) # underrun: silence and refill up to the target, nothing is dropped
+            self.buffering = True
             return
 
-        popped = []
-        for _ in range(self.CHUNKS):
-            popped.append( self.audio_buffer.get() )
-
-        popped = np.array(popped).flatten()
-        popped = popped.astype(np.float64) * (self.volume/100)
-
-        n = len(popped)
-        if self.SAMPLE_RATIO % 1: # high bandwidth kiwis (3ch 20kHz)
-            pyaudio_buffer = resample_poly(popped, self.n_high, self.n_low, padtype="line")[:-1]
-        else: # normal 12kHz kiwis
-            pyaudio_buffer = np.zeros(int(self.SAMPLE_RATIO*n))
-            pyaudio_buffer[::int(self.SAMPLE_RATIO)] = popped
-            pyaudio_buffer = np.concatenate([self.old_buffer, pyaudio_buffer])
-
-            # low pass filter
-            self.old_buffer = pyaudio_buffer[-(self.n_tap-1):]
-            pyaudio_buffer = self.kiwi_filter.lowpass(pyaudio_buffer) * int(self.SAMPLE_RATIO)
+        pyaudio_buffer = self.resampler.process(self.pending[:n_in], self.resampled[:frame_count], skew)
+        pyaudio_buffer *= self.volume/100
+        np.clip(pyaudio_buffer, -32768, 32767, out=pyaudio_buffer)
 
+        # stereo balance straight into the int16 output channels
         left_volume, right_volume = min(1-self.audio_balance, 1.0), min(1+self.audio_balance, 1.0)
-        outdata[:,0] = (pyaudio_buffer*left_volume**2).astype(np.int16)     # LEFT  CHANNEL
-        outdata[:,1] = (pyaudio_buffer*right_volume**2).astype(np.int16)    # RIGHT CHANNEL
+        channel = self.channel[:frame_count]
+        np.multiply(pyaudio_buffer, left_volume**2, out=channel)
+        np.copyto(outdata[:,0], channel, casting="unsafe")     # LEFT  CHANNEL
+        np.multiply(pyaudio_buffer, right_volume**2, out=channel)
+        np.copyto(outdata[:,1], channel, casting="unsafe")     # RIGHT CHANNEL
         if self.audio_rec.recording_flag:
             self.audio_rec.audio_buffer.append(pyaudio_buffer.astype(np.int16))
         # mute on TX (over some rssi threshold)
@@ -1143,50 +2091,51 @@ class kiwi_sound():
             self.mute_counter = self.muting_delay
         elif self.mute_counter > 0:
             self.mute_counter -= 1
-        if self.mute_counter > 0:
-            outdata *= 0
-        self.old_outdata = outdata[:]
+        if self.mute_counter > 0 or self.standby:
+            outdata.fill(0)
+
+    def put_audio(self, snd_buf):
+        # the event loop thread must not wait: a frame that does not fit is dropped, this only happens when
+        # the callback is stopped, the playout trim keeps the fill well below the ring capacity
+        if not self.audio_ring.write(snd_buf):
+            self.dropped_frames += 1
+
+    def buffered_frames(self):
+        # exact fill level, in Kiwi frames
+        return self.audio_ring.fill() / (self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS)
+
+    def track_jitter(self):
+        # interarrival jitter of the Kiwi frames (RFC 3550 style estimator) sets the target playout latency
+        now = time.monotonic()
+        if self.last_arrival is not None:
+            deviation = now - self.last_arrival - self.frame_s
+            self.jitter_s += (abs(deviation) - self.jitter_s) / 16
+        self.last_arrival = now
+        target = (self.JITTER_K * self.jitter_s + self.frame_s + self.block_s) * self.KIWI_RATE_TRUE
+        self.target_fill = min(max(target, self.KIWI_SAMPLES_PER_FRAME*self.CHUNKS), self.max_fill)
+        self.target_latency_ms = 1000 * self.target_fill / self.KIWI_RATE_TRUE
+
+    def on_message(self, data):
+        # from the event loop thread, one message
+        snd_buf = self.get_audio_chunk(data)
+        if snd_buf is not None:
+            self.track_jitter()
+            self.put_audio(snd_buf)
+            self.run_index += 1
 
-    def run(self):
-        self.total_delay_ms = 0.0
-        delta_time_ms = 0.0
-        self.ms_per_frame = (self.KIWI_SAMPLES_PER_FRAME / self.KIWI_RATE_TRUE) * 1000
-        self.late_flag = False
-        while not self.terminate:
-            time_prev = time.time_ns() / 1000000 # time in ms
-            snd_buf = self.get_audio_chunk()
-            if snd_buf is not None and not self.late_flag: # drop the audio frame if we're late!
-                self.audio_buffer.put(snd_buf)
-                self.run_index += 1
-                self.total_delay_ms -= delta_time_ms # subtract the frame time from the total delay whether we play it or drop it...
-            else:
-                self.total_delay_ms -= self.ms_per_frame # subtract the frame time from the total delay whether we play it or drop it...
-
-            time_now = time.time_ns() / 1000000 # time in ms
-            delta_time_ms = time_now - time_prev
-            self.total_delay_ms += delta_time_ms
-            # if self.status:
-            #     print(self.status)
-
-            if not self.late_flag and self.total_delay_ms > (self.FULL_BUFF_LEN+2) * self.ms_per_frame:
-                self.late_flag = True
-                # print("AUDIO STREAM NOT IN SYNC: DROPPING!")
-                print("!", end='')
-
-            if self.late_flag and self.total_delay_ms < self.ms_per_frame:
-                # print("AUDIO STREAM SYNCED")
-                # refill the buffer after underrun
-                # do this only for very short buffers (local kiwis only!)
-                while self.audio_buffer.qsize() < self.FULL_BUFF_LEN:
-                    snd_buf = self.get_audio_chunk()
-                    if snd_buf is not None:
-                        self.audio_buffer.put(snd_buf)
-                self.late_flag = False
-                self.total_delay_ms = 0.0
-                delta_time_ms = 0.0
+class audio_output():
+    # the sounddevice OutputStream of a receiver, opened once. Its callback plays the current kiwi_sound;
+    # during a server switch the next one runs silently in the same callback to keep its buffer at the target,
+    # switch() makes it the one heard from the next block. Single-open audio devices are never opened twice
 
-def start_audio_stream(kiwi_snd):
-    def _get_std_input_dev():
+    def __init__(self, kiwi_snd):
+        self.sources = (kiwi_snd, None) # (heard, standby), replaced as a whole, the callback reads it once
+        self.blocksize = kiwi_snd.blocksize
+        self.scratch = np.zeros((self.blocksize, kiwi_snd.CHANNELS), dtype=kiwi_snd.FORMAT) # standby output
+        self.stream = sd.OutputStream(blocksize = self.blocksize, device=self.get_std_input_dev(), dtype=kiwi_snd.FORMAT,
+            latency="low", samplerate=kiwi_snd.AUDIO_RATE, channels=kiwi_snd.CHANNELS, callback = self.play_buffer)
+
+    def get_std_input_dev(self):
         devices = sd.query_devices()
         for dev_id, device in enumerate(devices):
             if device["max_input_channels"] > 0 and "pulse" in device["name"]:
@@ -1195,26 +2144,327 @@ def start_audio_stream(kiwi_snd):
                 std_dev_id = None
         return std_dev_id
 
-    rx_t = threading.Thread(target=kiwi_snd.run, daemon=True)
-    rx_t.start()
+    def start(self):
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
 
-    print("Filling audio buffer...")
-    while kiwi_snd.audio_buffer.qsize() < kiwi_snd.FULL_BUFF_LEN and not kiwi_snd.terminate:
-        pass
+    def close(self):
+        self.stream.close()
+
+    def prepare(self, kiwi_snd):
+        # kiwi_snd (None to cancel) is played silently next to the current receiver
+        self.sources = (self.sources[0], kiwi_snd)
+
+    def switch(self):
+        heard, standby = self.sources
+        if standby:
+            self.sources = (standby, None)
+        return heard
+
+    def play_buffer(self, outdata, frame_count, time_info, status):
+        heard, standby = self.sources
+        self.play(heard, outdata, frame_count, time_info, status)
+        if standby:
+            self.play(standby, self.scratch[:frame_count], frame_count, time_info, status)
+
+    def play(self, kiwi_snd, outdata, frame_count, time_info, status):
+        # a Kiwi with another sample rate has smaller scratch buffers than the device block, it plays it in parts
+        for start in range(0, frame_count, kiwi_snd.blocksize):
+            n = min(kiwi_snd.blocksize, frame_count - start)
+            kiwi_snd.play_buffer(outdata[start:start+n], n, time_info, status)
+
+
+def fill_audio_buffer(kiwi_snd):
+    kiwi_loop.add(kiwi_snd)
+
+    print("Filling audio buffer, target latency %d ms..." % kiwi_snd.target_latency_ms)
+    while kiwi_snd.audio_ring.fill() < kiwi_snd.target_fill and not kiwi_snd.terminate:
+        time.sleep(0.01)
 
     if kiwi_snd.terminate:
         print("kiwi sound not started!")
-        del kiwi_snd
+        return False
+    return True
+
+
+def start_audio_stream(kiwi_snd):
+    if not fill_audio_buffer(kiwi_snd):
         return (None, None)
 
-    std_dev_id = _get_std_input_dev()
-    kiwi_audio_stream = sd.OutputStream(blocksize = int(kiwi_snd.KIWI_SAMPLES_PER_FRAME*kiwi_snd.CHUNKS*kiwi_snd.SAMPLE_RATIO),
-                        device=std_dev_id, dtype=kiwi_snd.FORMAT, latency="low", samplerate=kiwi_snd.AUDIO_RATE, channels=kiwi_snd.CHANNELS, callback = kiwi_snd.play_buffer)
+    kiwi_audio_stream = audio_output(kiwi_snd)
     kiwi_audio_stream.start()
 
     return True, kiwi_audio_stream
 
 
+class kiwi_switcher():
+    # make-before-break server change: the new W/F and SND streams are opened on a worker thread while the
+    # old ones keep playing, the UI loop swaps them in once both deliver data and the old ones are closed after.
+    # The worker only opens the streams, everything tied to the display and the EiBi list is done by swap().
+    # The new receiver is played through the audio output already open
+
+    def __init__(self, reactor, eibi, disp):
+        self.reactor = reactor
+        self.eibi = eibi
+        self.disp = disp
+        self.lock = threading.Lock()
+        self.thread = None
+        self.result = None # (host, port, password, kiwi_wf, kiwi_snd) ready to be swapped in
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, host, port, password, kiwi_wf, kiwi_snd, audio_stream):
+        if self.busy():
+            print("Server switch already in progress!")
+            return False
+        self.result = None
+        self.thread = threading.Thread(target=self.connect, args=(host, port, password, kiwi_wf.get_settings(), kiwi_snd, audio_stream), daemon=True)
+        self.thread.start()
+        return True
+
+    def connect(self, host, port, password, wf_settings, old_snd, audio_stream):
+        # worker thread: the W/F stream returns on its first frame and is left unread until the swap
+        new_wf, new_snd = None, None
+        try:
+            new_wf = kiwi_waterfall(host, port, password, wf_settings["zoom"], wf_settings["freq"], self.eibi, None)
+            new_snd = kiwi_sound(old_snd.freq, old_snd.radio_mode, old_snd.lc, old_snd.hc, password, new_wf, old_snd.FULL_BUFF_LEN, volume_=old_snd.volume)
+            if not fill_audio_buffer(new_snd):
+                raise Exception("no audio")
+        except Exception as e:
+            print("Cannot switch to %s:%s (%s), staying on the current server" % (host, port, e))
+            self.close(new_wf, [(new_snd, None)])
+            return
+        audio_stream.prepare(new_snd) # the old receiver is still the one being heard
+        with self.lock:
+            self.result = (host, port, password, new_wf, new_snd)
+
+    def poll(self):
+        # the new streams once they are ready, only once
+        with self.lock:
+            result, self.result = self.result, None
+        return result
+
+    def swap(self, old_wf, new_wf, old_snds, new_snd, audio_stream):
+        # UI thread: the new waterfall gets its display ring, the latest user settings go to the new streams
+        # (this also loads the EiBi stations of the span), the new receiver is heard from the next audio block
+        # and the old streams are closed in the background. old_snds: (kiwi_sound, its own audio output or None)
+        new_wf.setup_display(self.disp)
+        new_wf.restore_settings(old_wf.get_settings())
+        new_wf.wf_generation = old_wf.wf_generation + 1 # a new waterfall object, the display rebuilds it
+        new_wf.last_rx = time.monotonic()
+        self.reactor.add(new_wf)
+        new_snd.restore_settings(old_snds[0][0].get_settings())
+        audio_stream.switch()
+        for kiwi_snd, _ in old_snds:
+            kiwi_snd.standby = True # a sub receiver output plays until it is closed
+        threading.Thread(target=self.close, args=(old_wf, old_snds), daemon=True).start()
+
+    def close(self, kiwi_wf, snds):
+        for kiwi_snd, audio_stream in snds:
+            try:
+                if audio_stream:
+                    audio_stream.stop()
+                    audio_stream.close()
+            except Exception as e:
+                print("exception: %s" % e)
+            if kiwi_snd:
+                kiwi_snd.close_connection()
+                kiwi_snd.terminate = True
+        if kiwi_wf:
+            kiwi_wf.close_connection()
+            kiwi_wf.terminate = True
+
+
+class kiwi_panorama():
+    # one wide spectrum and waterfall stitched from several W/F streams set to adjacent zoom/start windows,
+    # on one or more Kiwis (a Kiwi with free channels can be listed more than once). The streams are spread
+    # over a few reactor threads, their raw lines land in one row buffer and the stitching is a single gather
+    # through a precomputed bin map. Each stream's noise floor is moved to the median floor of all the streams,
+    # this evens out the calibration differences between Kiwis and antennas
+    MAX_THREADS = 4
+    FLOOR_P = 20 # noise floor percentile of a line
+    CAL_DECAY = 0.05 # noise floor tracking per line
+    min_bin_spacing = 100 # minimum pixels between major ticks, as kiwi_waterfall
+    # same frequency axis as kiwi_waterfall: ticks, overlays and mouse tuning work on either view
+    offset_to_bin = kiwi_waterfall.offset_to_bin
+    bins_to_khz = kiwi_waterfall.bins_to_khz
+    deltabins_to_khz = kiwi_waterfall.deltabins_to_khz
+    gen_div = kiwi_waterfall.gen_div
+
+    def __init__(self, sources, start_khz, end_khz, n_streams, eibi, disp, supervisor=None):
+        # sources: (host, port, password) tuples, the windows are assigned to them in turn
+        self.range_khz = min(start_khz, end_khz), max(start_khz, end_khz) # as asked, plan() fits it to the Kiwis
+        self.zoom, centers = self.plan(n_streams, kiwi_waterfall.MAX_FREQ, kiwi_waterfall.MAX_ZOOM)
+        self.lock = threading.Lock()
+        self.wf_auto_scaling = True
+        self.wf_generation = 0
+        self.wf_lines = 0
+        self.wf_data, self.wf_head = None, 0
+
+        def _open(i):
+            host, port, password = sources[i % len(sources)]
+            try:
+                return kiwi_waterfall(host, port, password, self.zoom, centers[i], eibi, None)
+            except Exception as e:
+                print("Panorama window %d (%s:%d) not available: %s" % (i, host, port, e))
+        with ThreadPoolExecutor(max_workers=min(kiwi_prober.WORKERS, len(centers))) as pool:
+            self.streams = [stream for stream in pool.map(_open, range(len(centers))) if stream]
+        if not self.streams:
+            raise Exception("no panorama stream")
+
+        # the Kiwis tell their real range and zoom levels on connection (32 MHz models), plan again with them
+        max_freq, max_zoom = min(stream.MAX_FREQ for stream in self.streams), min(stream.MAX_ZOOM for stream in self.streams)
+        if (max_freq, max_zoom) != (kiwi_waterfall.MAX_FREQ, kiwi_waterfall.MAX_ZOOM):
+            self.zoom, centers = self.plan(n_streams, max_freq, max_zoom)
+            for stream in self.streams[len(centers):]:
+                stream.close_connection()
+            self.streams = self.streams[:len(centers)]
+            for stream, center in zip(self.streams, centers):
+                self.retune(stream, center)
+        self.make_map()
+
+        self.setup_display(disp)
+        self.line_f = np.zeros(self.WF_BINS, dtype=np.float32)
+        self.cal_line = np.zeros(self.WF_BINS, dtype=np.float32)
+        self.line = np.zeros(self.WF_BINS, dtype=np.uint8)
+        self.quantiles = quantile_tracker(kiwi_waterfall.AUTOSCALE_DECAY)
+        self.spectrum_avg = spectrum_averager(self.WF_BINS)
+
+        self.reactors = [kiwi_reactor() for _ in range(min(self.MAX_THREADS, len(self.streams)))]
+        for i, stream in enumerate(self.streams):
+            stream.panorama = self
+            reactor = self.reactors[i % len(self.reactors)]
+            reactor.add(stream)
+            if supervisor:
+                supervisor.watch(stream, reactor)
+        print("Panorama %.0f-%.0f kHz: %d streams at zoom %d, %d bins of %.2f kHz" % (self.start_khz, self.end_khz,
+            len(self.streams), self.zoom, self.WF_BINS, self.bin_khz))
+
+    def plan(self, n_streams, max_freq, max_zoom):
+        # the highest zoom whose windows still cover the range, spread evenly with equal overlaps
+        self.start_khz, self.end_khz = max(self.range_khz[0], 0), min(self.range_khz[1], max_freq)
+        n_streams = max(1, n_streams)
+        zoom = int(np.clip(np.floor(np.log2(max_freq * n_streams / (self.end_khz - self.start_khz))), 0, max_zoom))
+        window_khz = max_freq / 2**zoom
+        n_streams = min(n_streams, int(np.ceil((self.end_khz - self.start_khz) / window_khz))) # no redundant windows
+        centers = np.linspace(self.start_khz + window_khz/2, self.end_khz - window_khz/2, n_streams) if n_streams > 1 else [(self.start_khz + self.end_khz)/2]
+        return zoom, [min(max(center, window_khz/2), max_freq - window_khz/2) for center in centers]
+
+    def retune(self, stream, center):
+        # window of a stream already open, without touching the EiBi stations of the main waterfall
+        stream.freq, stream.zoom = center, self.zoom
+        stream.zoom_to_span()
+        stream.start_freq()
+        stream.end_freq()
+        stream.counter, stream.actual_freq = stream.start_frequency_to_counter(stream.start_f_khz)
+        stream.send_msg("SET zoom=%d start=%d" % (self.zoom, stream.counter))
+
+    def make_map(self):
+        # source row and bin of every output bin: where windows overlap the one whose center is nearest wins,
+        # the edges of a Kiwi spectrum roll off; bins outside every window read a constant zero level
+        n = len(self.streams)
+        self.bin_khz = min(stream.span_khz / stream.WF_BINS for stream in self.streams)
+        self.WF_BINS = int(np.ceil((self.end_khz - self.start_khz) / self.bin_khz))
+        self.bins_per_khz = 1. / self.bin_khz
+        freqs = self.start_khz + (np.arange(self.WF_BINS) + 0.5) * self.bin_khz
+        offsets = np.cumsum([0] + [stream.WF_BINS for stream in self.streams])
+        distance = np.full((n+1, self.WF_BINS), np.inf)
+        distance[n] = 1e12 # the zero level, when nothing else covers a bin
+        src_bins = np.zeros((n+1, self.WF_BINS), dtype=np.int64)
+        for i, stream in enumerate(self.streams):
+            start_khz = stream.actual_freq
+            position = (freqs - start_khz) / stream.span_khz * stream.WF_BINS
+            inside = (position > -1) & (position < stream.WF_BINS+1) # one bin of slack for the start quantization
+            distance[i, inside] = np.abs(freqs - (start_khz + stream.span_khz/2))[inside]
+            src_bins[i] = offsets[i] + np.clip(position.astype(np.int64), 0, stream.WF_BINS-1)
+        src_bins[n] = offsets[n]
+        self.src_stream = np.argmin(distance, axis=0)
+        self.src_flat = src_bins[self.src_stream, np.arange(self.WF_BINS)]
+        self.raw = np.zeros(offsets[n]+1, dtype=np.float32) # all the stream lines and the zero level
+        self.rows = [self.raw[offsets[i]:offsets[i+1]] for i in range(n)]
+        self.index = {stream: i for i, stream in enumerate(self.streams)}
+        self.fresh = np.zeros(n, dtype=bool)
+        self.floors = np.full(n, np.nan)
+        self.cal = np.zeros(n+1, dtype=np.float32) # dB added to each stream, the last one for the zero level
+
+        # frequency axis of the stitched bins
+        self.span_khz = self.WF_BINS * self.bin_khz
+        self.start_f_khz, self.end_f_khz = self.start_khz, self.start_khz + self.span_khz
+        self.freq = self.start_f_khz + self.span_khz/2
+        self.freq_offset = self.streams[0].freq_offset
+        self.gen_div()
+
+    def setup_display(self, disp):
+        # UI thread: pixel mapping and waterfall ring sized for the display, the newest lines are kept
+        self.BINS2PIXEL_RATIO = disp.DISPLAY_WIDTH / self.WF_BINS
+        with self.lock:
+            self.wf_data, self.wf_head = resized_ring(self.wf_data, self.wf_head, disp.WF_HEIGHT, self.WF_BINS), 0
+            self.wf_generation += 1
+
+    def put_line(self, stream):
+        # from a reactor thread: store the raw line, a panorama line is made once every stream delivered one
+        i = self.index[stream]
+        line = stream.spectrum
+        line[0] = line[1] # first bin is broken
+        floor = np.percentile(line, self.FLOOR_P)
+        with self.lock:
+            if self.fresh[i]:
+                self.make_line() # this stream is ahead, the last lines of the slower ones are reused
+            self.rows[i][:len(line)] = line
+            if np.isnan(self.floors[i]):
+                self.floors[i] = floor
+            else:
+                self.floors[i] += self.CAL_DECAY * (floor - self.floors[i])
+            self.fresh[i] = True
+            if self.fresh.all():
+                self.make_line()
+
+    def make_line(self):
+        np.subtract(np.nanmedian(self.floors), self.floors, out=self.cal[:-1])
+        np.nan_to_num(self.cal, copy=False)
+        np.take(self.raw, self.src_flat, out=self.line_f)
+        np.take(self.cal, self.src_stream, out=self.cal_line)
+        self.line_f += self.cal_line
+        np.clip(self.line_f, 0, 255, out=self.line_f)
+        np.rint(self.line_f, out=self.cal_line)
+        np.copyto(self.line, self.cal_line, casting="unsafe")
+        self.fresh[:] = False
+
+        # same auto scaling as a single waterfall on whole levels, the colours keep the fractional levels
+        # of the calibration and of averaged lines
+        self.quantiles.update(self.line)
+        low = self.quantiles.percentile(kiwi_waterfall.CLIP_LOWP)
+        dynamic_range = max(self.quantiles.percentile(kiwi_waterfall.CLIP_HIGHP) - low, kiwi_waterfall.MIN_DYN_RANGE)
+        self.line_f -= low
+        self.line_f *= 254 / dynamic_range
+        np.clip(self.line_f, 0, 254, out=self.line_f)
+        head = (self.wf_head - 1) % len(self.wf_data)
+        np.copyto(self.wf_data[head], self.line_f, casting="unsafe")
+        self.wf_head = head
+        self.spectrum_avg.push(self.wf_data[head])
+        self.wf_lines += 1
+        if not pygame.event.peek(WF_LINE_EVENT):
+            pygame.event.post(pygame.event.Event(WF_LINE_EVENT))
+
+    def get_lines(self, since=None):
+        # copy of the lines pushed after line count since, newest first, and the line count they bring the
+        # display to: the whole waterfall if since is None or too old
+        with self.lock:
+            new_lines = self.wf_lines - since if since is not None else -1
+            if not 0 <= new_lines < len(self.wf_data):
+                new_lines = len(self.wf_data)
+            return np.take(self.wf_data, self.wf_head + np.arange(new_lines), axis=0, mode="wrap"), self.wf_lines
+
+    def close(self):
+        for stream in self.streams:
+            stream.close_connection()
+            stream.terminate = True
+            stream.panorama = None
+
+
 class cat:
     CAT_MIN_FREQ = 100 # 100 kHz is OK for most radios
     CAT_MAX_FREQ = 30000
@@ -1360,14 +2610,55 @@ class eibi_db():
         return name_list
 
 
+class dirty_regions():
+    # horizontal bands of the window to be redrawn and pushed to the screen in the next frame
+    BANDS = ["top", "spectrum", "tunebar", "wf", "bottom"]
+
+    def __init__(self):
+        self.signatures = {}
+        self.dirty = set(self.BANDS)
+
+    def mark(self, *bands):
+        # no bands -> whole window
+        self.dirty.update(bands if bands else self.BANDS)
+
+    def check(self, key, signature, *bands):
+        # mark the bands drawn from some inputs when their signature changed
+        if self.signatures.get(key) != signature:
+            self.signatures[key] = signature
+            self.mark(*bands)
+
+    def clear(self):
+        self.dirty.clear()
+
+    def rect(self, disp, first, last=None):
+        # window area from band first to band last
+        i, j = self.BANDS.index(first), self.BANDS.index(last if last else first)
+        band_y = [disp.TOPBAR_Y, disp.SPECTRUM_Y, disp.TUNEBAR_Y, disp.WF_Y, disp.BOTTOMBAR_Y, disp.DISPLAY_HEIGHT]
+        return pygame.Rect(0, band_y[i], disp.DISPLAY_WIDTH, band_y[j+1]-band_y[i])
+
+    def span(self, disp):
+        # one clipping rect: every band between the first and the last dirty one is redrawn
+        dirty = [band for band in self.BANDS if band in self.dirty]
+        self.dirty.update(self.BANDS[self.BANDS.index(dirty[0]):self.BANDS.index(dirty[-1])+1])
+        return self.rect(disp, dirty[0], dirty[-1])
+
+
 class display_stuff():
     wf_bottom, wf_top = 0, 0
     s_meter_radius = 100
     s_meter_border = 20
     audio_buff_len = 0
     audio_buff_len2 = 0
+    deflate_text = "" # permessage-deflate received/inflated ratio of the streams, empty without compression
+    slow_update_time = 0
 
     def __init__(self, WIDTH, HEIGHT=None):
+        self.wf_surface = None # persistent waterfall surface at display resolution
+        self.wf_surface_lines, self.wf_surface_generation = 0, None
+        self.spectrum_surface = None # 8 bit scope surface at display resolution
+        self.spectrum_grid_rows, self.spectrum_grid_key = [], None
+        self.spectrum_x_bins, self.spectrum_x_bins_n = np.zeros(0), 0
         # SuperSDR constants
         self.DISPLAY_WIDTH = WIDTH
         if HEIGHT==None:
@@ -1411,24 +2702,27 @@ class display_stuff():
         #     colormap = cm.jet(range(256))[:,:3]*255
         return colormap
 
-    def update_textsurfaces(self, surface_, radio_mode, rssi_smooth, rssi_smooth_slow, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, kiwi_host2, run_index):
+    def update_textsurfaces(self, surface_, radio_mode, rssi_smooth, rssi_smooth_slow, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, kiwi_host2, axis=None):
+        axis = axis if axis else kiwi_wf # frequency axis shown, the main waterfall or the panorama
         mousex_pos = mouse[0]
         if mousex_pos < 25:
             mousex_pos = 25
         elif mousex_pos >= self.DISPLAY_WIDTH - 80:
             mousex_pos = self.DISPLAY_WIDTH - 80
-        mouse_khz = kiwi_wf.bins_to_khz(mouse[0]/kiwi_wf.BINS2PIXEL_RATIO)
-        buff_level = kiwi_snd.audio_buffer.qsize()
+        mouse_khz = axis.bins_to_khz(mouse[0]/axis.BINS2PIXEL_RATIO)
         main_rx_color = RED
         sub_rx_color = GREEN
         tx_on_flag = False
 
-        if not run_index%20:
+        if time.monotonic() - self.slow_update_time >= SLOW_UPDATE_S:
+            self.slow_update_time = time.monotonic()
             self.wf_bottom = kiwi_wf.wf_min_db
             self.wf_top = kiwi_wf.wf_max_db
-            self.audio_buff_len = kiwi_snd.audio_buffer.qsize()
+            self.audio_buff_len = kiwi_snd.buffered_frames()
             if fl.dualrx_flag and kiwi_snd2:
-                self.audio_buff_len2 = kiwi_snd2.audio_buffer.qsize()
+                self.audio_buff_len2 = kiwi_snd2.buffered_frames()
+            ratios = [(label, stream.deflate_ratio()) for label, stream in (("W", kiwi_wf), ("S", kiwi_snd)) if stream.deflate]
+            self.deflate_text = " ".join("%s:%s" % (label, "--" if math.isinf(ratio) else "%.2f" % ratio) for label, ratio in ratios)
 
         audio_balance_string_list = ["<<", "<", "=", ">", ">>"]
         audio_balance_string_main = audio_balance_string_list[int((kiwi_snd.audio_balance+1)*2)]
@@ -1440,32 +2734,34 @@ class display_stuff():
         if cat_radio:
             tx_on_flag = cat_radio.cat_tx
         #           Label   Color   Freq/Mode                       Screen position
-        ts_dict = {"wf_freq": (YELLOW, "%.1f"%(kiwi_wf.freq+kiwi_wf.freq_offset if fl.cat_snd_link_flag else kiwi_wf.freq+kiwi_wf.freq_offset), (self.DISPLAY_WIDTH/2-48,self.TUNEBAR_Y+1), "small", False),
-                "left": (GREEN, "%.1f"%(kiwi_wf.start_f_khz+kiwi_wf.freq_offset) ,(0,self.TUNEBAR_Y+1), "small", False),
-                "right": (GREEN, "%.1f"%(kiwi_wf.end_f_khz+kiwi_wf.freq_offset), (self.DISPLAY_WIDTH-65,self.TUNEBAR_Y+1), "small", False),
+        ts_dict = {"wf_freq": (YELLOW, "%.1f"%(axis.freq+axis.freq_offset if fl.cat_snd_link_flag else axis.freq+axis.freq_offset), (self.DISPLAY_WIDTH/2-48,self.TUNEBAR_Y+1), "small", False),
+                "left": (GREEN, "%.1f"%(axis.start_f_khz+axis.freq_offset) ,(0,self.TUNEBAR_Y+1), "small", False),
+                "right": (GREEN, "%.1f"%(axis.end_f_khz+axis.freq_offset), (self.DISPLAY_WIDTH-65,self.TUNEBAR_Y+1), "small", False),
                 "rx_freq": (main_rx_color, "MAIN:%.3fkHz %s %s"%(kiwi_snd.freq+kiwi_snd.freq_offset+(CW_PITCH if kiwi_snd.radio_mode=="CW" else 0), kiwi_snd.radio_mode, "MUTE" if kiwi_snd.volume==0 else "%d%% %s"%(kiwi_snd.volume, audio_balance_string_main)), (self.DISPLAY_WIDTH/2-130,self.V_POS_TEXT-1), "big", False),
                 "kiwi": (ORANGE, kiwi_wf.host[:40]+":%d"%kiwi_wf.port ,(95,self.BOTTOMBAR_Y+6), "small", False),
-                "span": (GREEN, "SPAN:%.0fkHz"%((kiwi_wf.span_khz)), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+1), "small", False),
+                "span": (GREEN, "SPAN:%.0fkHz"%((axis.span_khz)), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+1), "small", False),
                 "filter": (GREY, "FILT:%.0f Hz"%((kiwi_snd.hc-kiwi_snd.lc)), (self.DISPLAY_WIDTH/2+230, self.V_POS_TEXT), "small", False),
                 "p_freq": (WHITE, "%dkHz"%mouse_khz, (mousex_pos+4, self.TUNEBAR_Y-50), "small", False, "BLACK"),
                 "auto": ((GREEN if fl.auto_mode else RED), "[AUTO]" if fl.auto_mode else "[MANU]", (self.DISPLAY_WIDTH/2+170, self.V_POS_TEXT), "small", False),
                 #"center": ((GREEN if fl.wf_snd_link_flag else GREY), "CENTER", (wf_width-145, self.SPECTRUM_Y+2), "small", False),
                 "sync": ((GREEN if fl.cat_snd_link_flag else GREY), "SYNC", (40, self.BOTTOMBAR_Y+3), "big", False),
                 "cat": (GREEN if cat_radio else GREY, "CAT", (5,self.BOTTOMBAR_Y+3), "big", False), 
-                "recording": (RED if kiwi_snd.audio_rec.recording_flag and run_index%2 else D_GREY, "REC", (self.DISPLAY_WIDTH-90, self.BOTTOMBAR_Y+3), "big", False),
+                "recording": (RED if kiwi_snd.audio_rec.recording_flag and blink_on() else D_GREY, "REC", (self.DISPLAY_WIDTH-90, self.BOTTOMBAR_Y+3), "big", False),
                 "dxcluster": (GREEN if fl.show_dxcluster_flag else D_GREY, "DXCLUST", (self.DISPLAY_WIDTH-200, self.BOTTOMBAR_Y+3), "big", False),
                 "utc": (ORANGE, datetime.utcnow().strftime(" %d %b %Y %H:%M:%SZ"), (self.DISPLAY_WIDTH-180, self.V_POS_TEXT), "small", False),
                 "wf_bottom": (WHITE, "%ddB"%(self.wf_bottom), (0,self.TUNEBAR_Y-14), "small", False, "BLACK"),
                 "wf_param": (WHITE, "%ddB %s"%(self.wf_top, "AUTO" if kiwi_wf.wf_auto_scaling else ""), (0,self.SPECTRUM_Y+1), "small", False, "BLACK"),
                 "help": (BLUE, "HELP", (self.DISPLAY_WIDTH-50, self.BOTTOMBAR_Y+3), "big", False),
                 "adc_overflow": (RED if kiwi_snd.adc_overflow_flag else D_GREY, "OVF", (self.DISPLAY_WIDTH-270, self.BOTTOMBAR_Y+3), "big", False),
-                "audio_buffer": (GREEN if self.audio_buff_len>kiwi_snd.FULL_BUFF_LEN/3 else RED, "M:"+str(self.audio_buff_len), (self.DISPLAY_WIDTH-350, self.BOTTOMBAR_Y+6), "small", False)
+                "audio_buffer": (GREEN if self.audio_buff_len*kiwi_snd.KIWI_SAMPLES_PER_FRAME>kiwi_snd.target_fill/2 else RED, "M:%.1f"%self.audio_buff_len, (self.DISPLAY_WIDTH-350, self.BOTTOMBAR_Y+6), "small", False)
                 }
 
         if fl.dualrx_flag and kiwi_snd2:
             ts_dict["rx_freq2"] = (sub_rx_color, "SUB:%.3fkHz %s %s"%(kiwi_snd2.freq+kiwi_snd2.freq_offset+(CW_PITCH if kiwi_snd2.radio_mode=="CW" else 0), kiwi_snd2.radio_mode, "MUTE" if kiwi_snd2.volume==0 else "%d%% %s"%(kiwi_snd2.volume, audio_balance_string_sub)), (self.DISPLAY_WIDTH/2-430,self.V_POS_TEXT-1), "big", False)
-            ts_dict["audio_buffer2"] = (GREEN if self.audio_buff_len2>kiwi_snd2.FULL_BUFF_LEN/3 else RED, "S:"+str(self.audio_buff_len2), (self.DISPLAY_WIDTH-310, self.BOTTOMBAR_Y+6), "small", False)
+            ts_dict["audio_buffer2"] = (GREEN if self.audio_buff_len2*kiwi_snd2.KIWI_SAMPLES_PER_FRAME>kiwi_snd2.target_fill/2 else RED, "S:%.1f"%self.audio_buff_len2, (self.DISPLAY_WIDTH-310, self.BOTTOMBAR_Y+6), "small", False)
                                 
+        if self.deflate_text:
+            ts_dict["deflate"] = (GREY, "DEFL " + self.deflate_text, (self.DISPLAY_WIDTH-460, self.BOTTOMBAR_Y+6), "small", False)
         if not fl.s_meter_show_flag:
             s_value = (round(rssi_smooth_slow)+127)//6 # signal in S units of 6dB
             if s_value<=9:
@@ -1474,57 +2770,62 @@ class display_stuff():
                 s_value = "S9+"+str(int((s_value-9)*6))+"dB"
             ts_dict["smeter"] = (ORANGE if not tx_on_flag else "RED", s_value if not tx_on_flag else "TX", (5,self.V_POS_TEXT-1), "big", False)
         if fl.click_drag_flag:
-            delta_khz = kiwi_wf.deltabins_to_khz(fl.start_drag_x*kiwi_wf.BINS2PIXEL_RATIO - mousex_pos)
+            delta_khz = axis.deltabins_to_khz(fl.start_drag_x*axis.BINS2PIXEL_RATIO - mousex_pos)
             ts_dict["deltaf"] = (RED, ("+" if delta_khz>0 else "")+"%.1fkHz"%delta_khz, (self.DISPLAY_WIDTH/2,self.SPECTRUM_Y+20), "big", False)
         if kiwi_wf.averaging_n>1:
             ts_dict["avg"] = (RED, "AVG %dX"%kiwi_wf.averaging_n, (10,self.SPECTRUM_Y+13), "small", False)
-        if len(kiwi_wf.div_list)>1:
-            ts_dict["div"] = (YELLOW, "DIV :%.0fkHz"%(kiwi_wf.space_khz/10), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+13), "small", False)
+        if len(axis.div_list)>1:
+            ts_dict["div"] = (YELLOW, "DIV :%.0fkHz"%(axis.space_khz/10), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+13), "small", False)
         else:
-            ts_dict["div"] = (WHITE, "DIV :%.0fkHz"%(kiwi_wf.space_khz/100), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+13), "small", False)
+            ts_dict["div"] = (WHITE, "DIV :%.0fkHz"%(axis.space_khz/100), (self.DISPLAY_WIDTH-105,self.SPECTRUM_Y+13), "small", False)
 
         draw_dict = {}
+        clip = surface_.get_clip() # freetype ignores the clipping rect, skip labels outside it
         for k in ts_dict:
             if k == "p_freq" and not (pygame.mouse.get_focused() and (self.WF_Y <= mouse[1] <= self.BOTTOMBAR_Y or self.TOPBAR_HEIGHT <= mouse[1] <= self.TUNEBAR_Y)):
                 continue
             if "small" in ts_dict[k][3]:
-                render_ = smallfont.render_to
+                font_ = smallfont
             elif "big" in ts_dict[k][3]:
-                render_ = bigfont.render_to
+                font_ = bigfont
+            if not clip.collidepoint(ts_dict[k][2]):
+                continue
+            render_ = font_.render_to
             try:
                 bg_col = ts_dict[k][5]
             except:
                 bg_col = None
             render_(surface_, ts_dict[k][2], ts_dict[k][1], ts_dict[k][0], bgcolor=bg_col)
 
-    def draw_lines(self, surface_, wf_height, radio_mode, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio):
+    def draw_lines(self, surface_, wf_height, radio_mode, mouse, kiwi_wf, kiwi_snd, kiwi_snd2, fl, cat_radio, axis=None):
+        axis = axis if axis else kiwi_wf # frequency axis shown, the main waterfall or the panorama
 
         def _plot_bandpass(color_, kiwi_):
-            snd_freq_bin = kiwi_wf.offset_to_bin(kiwi_.freq+kiwi_wf.span_khz/2-kiwi_wf.freq)
-            if snd_freq_bin>0 and snd_freq_bin< kiwi_wf.WF_BINS:
+            snd_freq_bin = axis.offset_to_bin(kiwi_.freq+axis.span_khz/2-axis.freq)
+            if snd_freq_bin>0 and snd_freq_bin< axis.WF_BINS:
                 # carrier line
-                pygame.draw.line(surface_, RED, (snd_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (snd_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
+                pygame.draw.line(surface_, RED, (snd_freq_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (snd_freq_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
             if cat_radio and not fl.cat_snd_link_flag:
-                tune_freq_bin = kiwi_wf.offset_to_bin(kiwi_wf.tune+kiwi_wf.span_khz/2-kiwi_wf.freq)
+                tune_freq_bin = axis.offset_to_bin(kiwi_wf.tune+axis.span_khz/2-axis.freq)
                 # tune wf line
-                pygame.draw.line(surface_, D_RED, (tune_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (tune_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 3)
+                pygame.draw.line(surface_, D_RED, (tune_freq_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (tune_freq_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 3)
                 
-            lc_bin = kiwi_wf.offset_to_bin(kiwi_.lc/1000.)
+            lc_bin = axis.offset_to_bin(kiwi_.lc/1000.)
             lc_bin = snd_freq_bin + lc_bin
-            if lc_bin>0 and lc_bin< kiwi_wf.WF_BINS:
+            if lc_bin>0 and lc_bin< axis.WF_BINS:
                 # low cut line
-                pygame.draw.line(surface_, color_, (lc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((lc_bin-5)*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
+                pygame.draw.line(surface_, color_, (lc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((lc_bin-5)*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
             
-            hc_bin = kiwi_wf.offset_to_bin(kiwi_.hc/1000)
+            hc_bin = axis.offset_to_bin(kiwi_.hc/1000)
             hc_bin = snd_freq_bin + hc_bin
-            if hc_bin>0 and hc_bin< kiwi_wf.WF_BINS:
+            if hc_bin>0 and hc_bin< axis.WF_BINS:
                 # high cut line
-                pygame.draw.line(surface_, color_, (hc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((hc_bin+5)*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
-            pygame.draw.line(surface_, color_, (lc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (hc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), 2)
+                pygame.draw.line(surface_, color_, (hc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((hc_bin+5)*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
+            pygame.draw.line(surface_, color_, (lc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (hc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), 2)
 
-        center_freq_bin = kiwi_wf.offset_to_bin(kiwi_wf.span_khz/2)
+        center_freq_bin = axis.offset_to_bin(axis.span_khz/2)
         # center WF line
-        pygame.draw.line(surface_, RED, (center_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.WF_Y), (center_freq_bin*kiwi_wf.BINS2PIXEL_RATIO, self.WF_Y+6), 4)
+        pygame.draw.line(surface_, RED, (center_freq_bin*axis.BINS2PIXEL_RATIO, self.WF_Y), (center_freq_bin*axis.BINS2PIXEL_RATIO, self.WF_Y+6), 4)
         # mouse click_freq line
         if pygame.mouse.get_focused() and self.WF_Y <= mouse[1] <= self.BOTTOMBAR_Y:
             pygame.draw.line(surface_, RED, (mouse[0], self.TUNEBAR_Y), (mouse[0], self.BOTTOMBAR_Y), 1)
@@ -1539,30 +2840,30 @@ class display_stuff():
 
         #### CAT RADIO bandpass
         if cat_radio and not fl.cat_snd_link_flag:
-            tune_freq_bin = kiwi_wf.offset_to_bin(kiwi_wf.tune+kiwi_wf.span_khz/2-kiwi_wf.freq)
+            tune_freq_bin = axis.offset_to_bin(kiwi_wf.tune+axis.span_khz/2-axis.freq)
             lc_, hc_ = kiwi_wf.change_passband(delta_low, delta_high)
-            lc_bin = kiwi_wf.offset_to_bin(lc_/1000.)
+            lc_bin = axis.offset_to_bin(lc_/1000.)
             lc_bin = tune_freq_bin + lc_bin + 1
-            if lc_bin>0 and lc_bin< kiwi_wf.WF_BINS:
+            if lc_bin>0 and lc_bin< axis.WF_BINS:
                 # low cut line
-                pygame.draw.line(surface_, ORANGE, (lc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((lc_bin-5)*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
+                pygame.draw.line(surface_, ORANGE, (lc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((lc_bin-5)*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
             
-            hc_bin = kiwi_wf.offset_to_bin(hc_/1000)
+            hc_bin = axis.offset_to_bin(hc_/1000)
             hc_bin = tune_freq_bin + hc_bin
-            if hc_bin>0 and hc_bin< kiwi_wf.WF_BINS:
+            if hc_bin>0 and hc_bin< axis.WF_BINS:
                 # high cut line
-                pygame.draw.line(surface_, ORANGE, (hc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((hc_bin+5)*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
-            pygame.draw.line(surface_, ORANGE, (lc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (hc_bin*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), 2)
+                pygame.draw.line(surface_, ORANGE, (hc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), ((hc_bin+5)*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), 1)
+            pygame.draw.line(surface_, ORANGE, (lc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), (hc_bin*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT/2), 2)
 
         # plot click and drag red horiz bar
         if fl.click_drag_flag:
-            pygame.draw.line(surface_, RED, (fl.start_drag_x*kiwi_wf.BINS2PIXEL_RATIO, self.SPECTRUM_Y+10), (mouse[0], self.SPECTRUM_Y+10), 4)
+            pygame.draw.line(surface_, RED, (fl.start_drag_x*axis.BINS2PIXEL_RATIO, self.SPECTRUM_Y+10), (mouse[0], self.SPECTRUM_Y+10), 4)
 
         # plot tuning minor and major ticks
-        for x in kiwi_wf.subdiv_list:
-            pygame.draw.line(surface_, WHITE, (x*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), (x*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+17), 1)
-        for x in kiwi_wf.div_list:
-            pygame.draw.line(surface_, YELLOW, (x*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), (x*kiwi_wf.BINS2PIXEL_RATIO, self.TUNEBAR_Y+12), 3)
+        for x in axis.subdiv_list:
+            pygame.draw.line(surface_, WHITE, (x*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), (x*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+17), 1)
+        for x in axis.div_list:
+            pygame.draw.line(surface_, YELLOW, (x*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+self.TUNEBAR_HEIGHT), (x*axis.BINS2PIXEL_RATIO, self.TUNEBAR_Y+12), 3)
 
 
     def display_box(self, screen, message, size):
@@ -1666,29 +2967,87 @@ class display_stuff():
         
         return smeter_surface
 
-    def plot_spectrum(self, sdrdisplay, kiwi_wf, t_avg=15, col=YELLOW, filled=False):
-        spectrum_surf = pygame.Surface((kiwi_wf.WF_BINS, self.SPECTRUM_HEIGHT))
-        pixarr = pygame.PixelArray(spectrum_surf)
-        if not kiwi_wf.wf_auto_scaling:
+    def spectrum_x(self, wf_bins):
+        # fractional bin position of every display column
+        if len(self.spectrum_x_bins) != self.DISPLAY_WIDTH or self.spectrum_x_bins_n != wf_bins:
+            self.spectrum_x_bins = (np.arange(self.DISPLAY_WIDTH)+0.5) * wf_bins/self.DISPLAY_WIDTH - 0.5
+            self.spectrum_x_bins_n = wf_bins
+        return self.spectrum_x_bins
+
+    def spectrum_grid(self, kiwi_wf):
+        # rows of the 10 dB grid, recomputed only when the scale changes
+        key = (kiwi_wf.wf_min_db, kiwi_wf.wf_max_db, self.SPECTRUM_HEIGHT)
+        if self.spectrum_grid_key != key:
             wf_dyn_range = kiwi_wf.wf_max_db-kiwi_wf.wf_min_db
             min_wf_10 = int(kiwi_wf.wf_min_db/10)*10
             max_wf_10 = int(kiwi_wf.wf_max_db/10)*10
             subdiv_list = [self.SPECTRUM_HEIGHT-1-int((v-kiwi_wf.wf_min_db)/wf_dyn_range * self.SPECTRUM_HEIGHT) for v in range(min_wf_10, max_wf_10, 10)]
-
-        for x, v in enumerate(np.nanmean(kiwi_wf.wf_data.T[:,:t_avg], axis=1)):
-            y = self.SPECTRUM_HEIGHT-1-int(v/255 * self.SPECTRUM_HEIGHT)
-            if filled:
-                pixarr[x,y:self.SPECTRUM_HEIGHT] = col
-            else:
-                pixarr[x,y] = col
-
-            if not kiwi_wf.wf_auto_scaling and not x%3:
-                for y_div in subdiv_list:
-                    pixarr[x,y_div] = D_GREEN
-        del pixarr
-        if self.DISPLAY_WIDTH != kiwi_wf.WF_BINS:
-            spectrum_surf = pygame.transform.smoothscale(spectrum_surf, (self.DISPLAY_WIDTH, self.SPECTRUM_HEIGHT))
-        sdrdisplay.blit(spectrum_surf, (0, self.SPECTRUM_Y))
+            self.spectrum_grid_rows = [y for y in subdiv_list if 0 <= y < self.SPECTRUM_HEIGHT]
+            self.spectrum_grid_key = key
+        return self.spectrum_grid_rows
+
+    def plot_spectrum(self, sdrdisplay, kiwi_wf, col=YELLOW, filled=False):
+        size = (self.DISPLAY_WIDTH, self.SPECTRUM_HEIGHT)
+        if self.spectrum_surface is None or self.spectrum_surface.get_size() != size:
+            # palette: 0 background, 1 trace, 2 grid
+            self.spectrum_surface = pygame.Surface(size, depth=8)
+            self.spectrum_surface.set_palette([BLACK, col, D_GREEN])
+            self.spectrum_rows = np.arange(self.SPECTRUM_HEIGHT, dtype=np.int16)[:,None]
+        self.spectrum_surface.set_palette_at(1, col)
+
+        # averaged spectrum kept by the W/F thread, resampled to the display width
+        spectrum = kiwi_wf.spectrum_avg.get()
+        spectrum = np.interp(self.spectrum_x(kiwi_wf.WF_BINS), np.arange(kiwi_wf.WF_BINS), spectrum)
+        y = self.SPECTRUM_HEIGHT-1 - (spectrum/255 * self.SPECTRUM_HEIGHT).astype(np.int16)
+        np.clip(y, 0, self.SPECTRUM_HEIGHT-1, out=y)
+
+        # the whole scope is one comparison written straight into the surface pixels (rows x columns)
+        pixels = pygame.surfarray.pixels2d(self.spectrum_surface).T
+        if filled:
+            np.greater_equal(self.spectrum_rows, y, out=pixels, casting="unsafe")
+        else:
+            np.equal(self.spectrum_rows, y, out=pixels, casting="unsafe")
+        if not kiwi_wf.wf_auto_scaling:
+            pixels[self.spectrum_grid(kiwi_wf), ::3] = 2
+        del pixels
+        sdrdisplay.blit(self.spectrum_surface, (0, self.SPECTRUM_Y))
+
+    def render_wf_lines(self, lines, size):
+        # W/F lines (palette indices) to a surface in the screen format, smoothscaled to size
+        native = pygame.Surface((lines.shape[1], lines.shape[0]), 0, self.wf_surface)
+        if native.get_bytesize() == 4:
+            pixels = pygame.surfarray.pixels2d(native).T
+            np.take(self.wf_colors, lines, out=pixels)
+            del pixels
+        else: # pixels2d needs 32 bit pixels
+            pygame.surfarray.blit_array(native, np.take(self.wf_colors, lines).T)
+        if native.get_size() != size:
+            scale = pygame.transform.smoothscale if native.get_bitsize() >= 24 else pygame.transform.scale
+            native = scale(native, size)
+        return native
+
+    def plot_waterfall(self, sdrdisplay, kiwi_wf, palette):
+        wf_rows, wf_bins = kiwi_wf.wf_data.shape
+        size = (self.DISPLAY_WIDTH, self.WF_HEIGHT)
+        rebuild = (self.wf_surface is None or self.wf_surface.get_size() != size
+            or self.wf_surface_generation != kiwi_wf.wf_generation or wf_rows != self.WF_HEIGHT)
+        if self.wf_surface is None or self.wf_surface.get_size() != size:
+            # display resolution surface in the screen format, palette indices go through a mapped colors table
+            self.wf_surface = pygame.Surface(size, 0, sdrdisplay)
+            palette = list(palette) + [WHITE] * (256-len(palette))
+            self.wf_colors = np.array([self.wf_surface.map_rgb([int(c) for c in col]) for col in palette[:256]], dtype=np.uint32)
+
+        # the lines are copied under the producer lock, the reactor keeps pushing while they are drawn
+        self.wf_surface_generation = kiwi_wf.wf_generation
+        lines, self.wf_surface_lines = kiwi_wf.get_lines(None if rebuild else self.wf_surface_lines)
+        new_lines = len(lines)
+        if new_lines == wf_rows:
+            self.wf_surface.blit(self.render_wf_lines(lines, size), (0, 0))
+        elif new_lines:
+            # only the newest lines are scaled, the rest of the waterfall is scrolled down
+            self.wf_surface.scroll(0, new_lines)
+            self.wf_surface.blit(self.render_wf_lines(lines, (self.DISPLAY_WIDTH, new_lines)), (0, 0))
+        sdrdisplay.blit(self.wf_surface, (0, self.WF_Y))
 
     def plot_eibi(self, surface_, eibi, kiwi_wf):
         y_offset = 0